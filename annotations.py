@@ -0,0 +1,44 @@
+# Reads annotations.txt. Each line has a kind, a hexadecimal address and
+# for some kinds a text:
+#   l <addr> <label>
+#   c <addr> <comment>
+#   x <addr>
+
+ANNOTATIONS_PATH = "annotations.txt"
+
+class Annotations:
+    def __init__(self, path=ANNOTATIONS_PATH):
+        self.labels = {}
+        self.addrs = {}
+        self.comments = {}
+        self.marked = set()
+        with open(path) as f:
+            for line in f:
+                parts = line.split(maxsplit=2)
+                if not parts:
+                    continue
+                kind = parts[0]
+                addr = int(parts[1], 16)
+                text = parts[2].strip() if len(parts) > 2 else ""
+                if kind == "l":
+                    self.labels[addr] = text
+                    self.addrs[text] = addr
+                elif kind == "c":
+                    self.comments.setdefault(addr, []).append(text)
+                elif kind == "x":
+                    self.marked.add(addr)
+                else:
+                    raise ValueError(f"Unknown annotation: {line!r}")
+
+    def name(self, addr):
+        if addr is None:
+            return "(top)"
+        return self.labels.get(addr, f"{addr:03x}")
+
+    def describe(self, addr):
+        # Label of addr, or address and comment.
+        if addr in self.labels:
+            return f"{addr:03x} {self.labels[addr]}"
+        if addr in self.comments:
+            return f"{addr:03x} ({self.comments[addr][0]})"
+        return f"{addr:03x}"
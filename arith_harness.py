@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+
+# Differential test of the arithmetic subroutines of the ROM against a
+# Decimal model. Random and edge case operands are put in R0 and R1, the
+# routine is called for all of them, spread over a pool of worker
+# processes, and R0 is compared with the model. Failing cases are shrunk to simpler operands
+# that still fail and saved as JSON lines.
+
+import argparse
+import decimal
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from itertools import repeat
+
+from emutools import create_emulator
+from calculator import decode_num
+
+# Digits of the significand (digits 12-2 of a register).
+PRECISION = 11
+ROUNDING = decimal.ROUND_DOWN
+MAX_EXP = 99
+
+# Results with an exponent outside [-MAX_EXP, MAX_EXP] make the ROM jump
+# to the error loop, so such operands are skipped.
+# The operations are done in the context, so they are rounded once.
+ROUTINES = {
+    "addr01": (0x082, lambda ctx, a, b: ctx.add(a, b)),
+    "subr01": (0x081, lambda ctx, a, b: ctx.subtract(a, b)),
+    "mulr01": (0x0c2, lambda ctx, a, b: ctx.multiply(a, b)),
+    "divr01": (0x0c1, lambda ctx, a, b: ctx.divide(a, b)),
+    "neg_abs_add1": (0x084, lambda ctx, a, b: ctx.subtract(1, a.copy_abs())),
+}
+
+# Negative zero: the sign bit set with a zero significand.
+NEG_ZERO = "-0"
+
+def context(precision=PRECISION, rounding=ROUNDING):
+    return decimal.Context(prec=precision, rounding=rounding)
+
+def reference(name, a, b, ctx):
+    # Result of the model, or None if the ROM signals an error.
+    a = Decimal(0) if a == NEG_ZERO else Decimal(a)
+    b = Decimal(0) if b == NEG_ZERO else Decimal(b)
+    try:
+        res = ROUTINES[name][1](ctx, a, b)
+    except (decimal.DivisionByZero, decimal.InvalidOperation):
+        return None
+    if res and abs(res.adjusted()) > MAX_EXP:
+        return None
+    return res
+
+def number(sign, digits, exp):
+    # Number with the significand digits (most significant first) and the
+    # exponent of the first digit.
+    return Decimal((sign, tuple(digits), exp - len(digits) + 1))
+
+def random_operand(rng, digits, exp=None):
+    n = rng.randint(1, digits)
+    sig = [rng.randint(1, 9)] + [rng.randint(0, 9) for i in range(n - 1)]
+    if exp is None:
+        exp = rng.randint(-MAX_EXP, MAX_EXP)
+    return number(rng.randint(0, 1), sig, exp)
+
+def edge_operands(digits):
+    # Extreme exponents and significands at the rounding boundaries of
+    # round9_r0 and round8_r0.
+    sigs = [[1], [9] * digits, [1] + [0] * (digits - 2) + [1],
+            [9] * (digits - 2) + [5], [9] * (digits - 1) + [5],
+            [4] + [9] * (digits - 1), [5]]
+    ops = [Decimal(0), NEG_ZERO]
+    for sig in sigs:
+        for exp in (-MAX_EXP, -MAX_EXP + 1, -1, 0, 1, MAX_EXP - 1, MAX_EXP):
+            for sign in (0, 1):
+                ops.append(number(sign, sig, exp))
+    return ops
+
+def operand_pairs(n, digits, seed):
+    rng = random.Random(seed)
+    edges = edge_operands(digits)
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.2:
+            yield rng.choice(edges), rng.choice(edges)
+        elif kind < 0.6:
+            # Close exponents, so the significands overlap in additions.
+            a = random_operand(rng, digits)
+            b = random_operand(rng, digits,
+                               min(MAX_EXP, max(-MAX_EXP, a.adjusted()
+                                                + rng.randint(-12, 12))))
+            yield a, b
+        else:
+            yield random_operand(rng, digits), random_operand(rng, digits)
+
+def encode(a):
+    # Digits 0-13 of a register holding the number, in the format described
+    # in the README.
+    digits = [0] * 14
+    if a == NEG_ZERO:
+        digits[13] = 8
+        return digits
+    if not a:
+        return digits
+    sign, sig, exp = a.normalize().as_tuple()
+    if len(sig) > 11:
+        raise ValueError(f"too many digits: {a}")
+    for k, d in enumerate(sig):
+        digits[12 - k] = d
+    top = exp + len(sig) - 1
+    digits[1], digits[0] = divmod(abs(top), 10)
+    digits[13] = (8 if sign else 0) | (2 if top < 0 else 0)
+    return digits
+
+def evaluate_chunk(start, addr, pairs):
+    res = []
+    for a, b in pairs:
+        e = start.fork()
+        e.regs[0][:14] = encode(a)
+        e.regs[1][:14] = encode(b)
+        e.call(addr)
+        res.append(decode_num(e.regs[0]))
+    return res
+
+# Emulator that evaluate forks in each worker process.
+worker_start = None
+
+def init_worker(start):
+    global worker_start
+    worker_start = start
+
+def evaluate_in_worker(addr, pairs):
+    return evaluate_chunk(worker_start, addr, pairs)
+
+def evaluate(name, pairs, start, workers, chunk=256):
+    # ROM results (Decimal) for the operand pairs, each computed on a fork
+    # of start, in a pool of worker processes unless workers=1.
+    addr = ROUTINES[name][0]
+    if workers is None:
+        workers = os.cpu_count()
+    if workers <= 1 or len(pairs) <= chunk:
+        return evaluate_chunk(start, addr, pairs)
+    chunks = [pairs[k:k + chunk] for k in range(0, len(pairs), chunk)]
+    with ProcessPoolExecutor(min(workers, len(chunks)),
+                             initializer=init_worker,
+                             initargs=(start,)) as ex:
+        return [r for res in ex.map(evaluate_in_worker, repeat(addr), chunks)
+                for r in res]
+
+def fails(name, a, b, start, ctx):
+    expected = reference(name, a, b, ctx)
+    if expected is None:
+        return False
+    return evaluate(name, [(a, b)], start, 1)[0] != expected
+
+def simpler(a):
+    # Candidates for a simpler operand than a, simplest first.
+    if a == NEG_ZERO or not a:
+        return []
+    sign, digits, exp = a.as_tuple()
+    top = exp + len(digits) - 1
+    res = []
+    if top:
+        res.append(number(sign, digits, 0))
+    if sign:
+        res.append(number(0, digits, top))
+    for k in range(len(digits) - 1, 0, -1):
+        res.append(number(sign, digits[:k], top))
+    for k in range(1, len(digits)):
+        if digits[k]:
+            res.append(number(sign, digits[:k] + (0,) + digits[k + 1:], top))
+    return [c.normalize() for c in res]
+
+def shrink(name, a, b, start, ctx):
+    # Greedily simplifies the operands while the case still fails.
+    progress = True
+    while progress:
+        progress = False
+        for c in simpler(a):
+            if fails(name, c, b, start, ctx):
+                a = c
+                progress = True
+                break
+        for c in simpler(b):
+            if fails(name, a, c, start, ctx):
+                b = c
+                progress = True
+                break
+    return a, b
+
+def run(names, n, batch=65536, digits=10, seed=0, workers=None,
+        precision=PRECISION, rounding=ROUNDING, out=None, max_failures=20):
+    ctx = context(precision, rounding)
+    start = create_emulator()
+    failures = []
+    for name in names:
+        begin = time.time()
+        pairs = operand_pairs(n, digits, seed)
+        done = 0
+        skipped = 0
+        mismatches = 0
+        while done < n:
+            chunk = []
+            expected = []
+            for a, b in pairs:
+                done += 1
+                ref = reference(name, a, b, ctx)
+                if ref is None:
+                    skipped += 1
+                else:
+                    chunk.append((a, b))
+                    expected.append(ref)
+                if len(chunk) >= batch or done >= n:
+                    break
+            if not chunk:
+                break
+            got = evaluate(name, chunk, start, workers)
+            for (a, b), want, res in zip(chunk, expected, got):
+                if res == want:
+                    continue
+                mismatches += 1
+                if len(failures) < max_failures:
+                    a, b = shrink(name, a, b, start, ctx)
+                    case = {"routine": name,
+                            "addr": f"{ROUTINES[name][0]:03x}",
+                            "a": str(a), "b": str(b),
+                            "expected": str(reference(name, a, b, ctx)),
+                            "got": str(evaluate(name, [(a, b)], start,
+                                                1)[0])}
+                    failures.append(case)
+                    if out is not None:
+                        out.write(json.dumps(case) + "\n")
+                        out.flush()
+        elapsed = time.time() - begin
+        print(f"{name}: {done - skipped} evaluations, {skipped} skipped, "
+              f"{mismatches} mismatches, {(done - skipped) / elapsed:.0f}/s",
+              file=sys.stderr)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("routines", nargs="*", default=list(ROUTINES))
+    parser.add_argument("-n", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=65536)
+    parser.add_argument("--digits", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--precision", type=int, default=PRECISION)
+    parser.add_argument("--rounding", default=ROUNDING)
+    parser.add_argument("--failures", default="arith_failures.jsonl")
+    args = parser.parse_args()
+    with open(args.failures, "w") as out:
+        failures = run(args.routines, args.n, args.batch, args.digits,
+                       args.seed, args.workers, args.precision,
+                       args.rounding, out)
+    print(f"{len(failures)} failures written to {args.failures}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+
+# Renders synthetic ROM die images from the dump and measures the speed
+# and accuracy of read_rom on them. No photos from img/ are needed.
+
+import argparse
+import imageio
+import numpy as np
+import os
+import resource
+import scipy.ndimage
+import tempfile
+import time
+import tracemalloc
+
+import read_rom
+from read_rom import NROWS, NCOLS, ImageDesc
+
+ROM_PATH = "mk51fx2500rom.txt"
+
+def load_ground_truth(path=ROM_PATH, seed=0):
+    # The dump has 4 of every 5 rows of bits. The fifth rows are filled
+    # with random bits and are not counted when checking the result.
+    with open(path) as f:
+        lines = f.read().split()
+    bits = np.random.default_rng(seed).integers(0, 2, (NROWS, NCOLS))
+    known = np.zeros((NROWS, NCOLS), dtype=bool)
+    for k, line in enumerate(lines):
+        i = k // 4 * 5 + k % 4
+        bits[i] = [int(c) for c in line]
+        known[i] = True
+    return bits, known
+
+def synth_desc(path, width, height, skew=0.0):
+    # Corners placed like in MK51_GH, rotated by skew degrees around the
+    # center of the image.
+    ref = read_rom.MK51_GH
+    scale = np.array([width / ref.width, height / ref.height])
+    a = np.radians(skew)
+    rot = np.array([[np.cos(a), -np.sin(a)], [np.sin(a), np.cos(a)]])
+    center = np.array([width, height]) / 2
+
+    def place(corners):
+        c = np.array(corners) * scale
+        c = (c - center) @ rot.T + center
+        return [[tuple(p) for p in row] for row in c.tolist()]
+
+    return ImageDesc(path, width, height, place(ref.rows_corners),
+                     place(ref.cols_corners))
+
+def render(desc, bits, blur=0.0, tear=0, gradient=0.0, noise=4.0, seed=0):
+    rng = np.random.default_rng(seed)
+    r = max(read_rom.patch_radius(desc), 2)
+    lattice = read_rom.bit_lattice(desc)
+    pos = np.round(lattice).astype(int)
+    if (pos.min() < r or np.any(pos.max(axis=(0, 1))
+                                >= [desc.width - r, desc.height - r])):
+        raise ValueError("bits fall outside of the "
+                         f"{desc.width}x{desc.height} image, try a smaller "
+                         "skew or a larger image")
+    img = np.full((desc.height, desc.width), 110, dtype=np.float32)
+    ones = np.zeros_like(img)
+    zeros = np.zeros_like(img)
+    for v, dst in ((1, ones), (0, zeros)):
+        p = pos[bits == v]
+        np.add.at(dst, (p[:, 1], p[:, 0]), 1)
+
+    # A one is a bright square gate, a zero a dim round contact.
+    yy, xx = np.mgrid[-r:r + 1, -r:r + 1]
+    one = np.where((abs(xx) <= r * 0.7) & (abs(yy) <= r * 0.5), 90, 0)
+    zero = np.where(xx ** 2 + yy ** 2 <= (r * 0.4) ** 2, 40, 0)
+    img += scipy.ndimage.convolve(ones, one.astype(np.float32),
+                                  mode="constant")
+    img += scipy.ndimage.convolve(zeros, zero.astype(np.float32),
+                                  mode="constant")
+
+    if blur > 0:
+        img = scipy.ndimage.gaussian_filter(img, blur)
+    if tear:
+        # A badly stitched band in the lower right part of the die.
+        y0 = int(lattice[NROWS * 3 // 4, 0, 1])
+        y1 = int(lattice[-1, 0, 1]) + 2 * r
+        x0 = int(lattice[0, NCOLS // 2, 0])
+        img[y0:y1, x0:] = np.roll(img[y0:y1, x0:], tear, axis=1)
+    if gradient:
+        gx = np.linspace(1 - gradient, 1 + gradient, desc.width,
+                         dtype=np.float32)
+        gy = np.linspace(1 + gradient / 2, 1 - gradient / 2, desc.height,
+                         dtype=np.float32)
+        img *= gy[:, None] * gx[None, :]
+    img += rng.normal(0, noise, img.shape).astype(np.float32)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    return np.repeat(img[..., None], 3, axis=-1)
+
+class Stages:
+    def __init__(self):
+        self.rows = []
+
+    def run(self, name, f, *args, **kwargs):
+        tracemalloc.start()
+        start = time.perf_counter()
+        res = f(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.rows.append((name, elapsed, peak))
+        return res
+
+    def report(self, nbits):
+        # The peak memory is traced in this process only, so with worker
+        # processes it misses the sampling done in them.
+        total = sum(t for _, t, _ in self.rows)
+        for name, t, peak in self.rows:
+            print(f"{name:12s} {t:8.3f} s {peak / 2**20:9.1f} MiB")
+        print(f"{'total':12s} {total:8.3f} s {nbits / total:9.0f} bits/s")
+
+def read_stages(stages, image, workers):
+    # Returns the bits as classified by k-means, before apply_fixes, which
+    # would hide misreads at the FIXES positions. apply_fixes is timed
+    # separately.
+    read_rom.corners_lattice.cache_clear()
+    stages.run("lattice", read_rom.bit_lattice, image.desc)
+    tiles = read_rom.kmeans_tiles()
+    bits = stages.run("sampling", lambda: np.stack(
+        read_rom.read_tiles_bits(image, tiles, workers)))
+    results = stages.run("kmeans", read_rom.cluster_tiles, image, tiles,
+                         bits)
+    res = read_rom.kmeans_read(tiles, results).bits
+    stages.run("apply_fixes", read_rom.apply_fixes, res)
+    return res
+
+def benchmark(width=9409, height=3210, skew=0.0, blur=0.0, tear=0,
+              gradient=0.0, noise=4.0, crop=False, workers=None, seed=0):
+    truth, known = load_ground_truth(seed=seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        desc = synth_desc(os.path.join(tmp, "synth.png"), width, height,
+                          skew)
+        imageio.imwrite(desc.path, render(desc, truth, blur, tear, gradient,
+                                          noise, seed))
+        stages = Stages()
+        image = stages.run("load_image", read_rom.load_image, desc,
+                           crop=crop)
+        bits = read_stages(stages, image, workers)
+    stages.report(NROWS * NCOLS)
+    errors = np.argwhere((bits != truth) & known)
+    print(f"misread {len(errors)} of {np.sum(known)} bits")
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"max rss {rss:.1f} MiB")
+    # Largest of the worker processes, if there were any.
+    if workers != 1:
+        rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        print(f"max rss of workers {rss:.1f} MiB")
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=9409)
+    parser.add_argument("--height", type=int, default=3210)
+    parser.add_argument("--skew", type=float, default=0.0,
+                        help="rotation in degrees")
+    parser.add_argument("--blur", type=float, default=0.0)
+    parser.add_argument("--tear", type=int, default=0,
+                        help="shift in pixels of a torn band")
+    parser.add_argument("--gradient", type=float, default=0.0)
+    parser.add_argument("--noise", type=float, default=4.0)
+    parser.add_argument("--crop", action="store_true")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    benchmark(**vars(args))
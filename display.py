@@ -0,0 +1,104 @@
+# The display of the calculator and events on its changes.
+#
+# The display shows digits 12-4 of R0, with the decimal points and the
+# indicators in bits 3 and 2 of the same digits of R1. A DisplayWatcher is
+# added to Emulator.hooks and compares a digest of what these digits show
+# after every step, so it produces an event only when the display changes.
+
+from collections import namedtuple
+
+DIGITS = slice(4, 13)
+
+# steps: value of the step counter when the display changed; digest: bytes
+# of what the display digits show, equal for equal displays; text:
+# display_text().
+DisplayEvent = namedtuple("DisplayEvent", ["steps", "digest", "text"])
+
+def digit_char(d):
+    if d <= 9:
+        return str(d)
+    elif d == 13:
+        return "E"
+    elif d == 14:
+        return "-"
+    return " "
+
+def display_digest(e):
+    # Only what is shown: the digits that are rendered as blanks are all
+    # the same, and only bits 3 and 2 of R1 are displayed.
+    return ("".join(digit_char(d) for d in e.regs[0][DIGITS]).encode()
+            + bytes(p & 12 for p in e.regs[1][DIGITS]))
+
+def display_text(e):
+    num = ""
+    ind = ""
+    for i in range(9):
+        num += digit_char(e.regs[0][12 - i])
+        p = e.regs[1][12 - i]
+        if p & 8:
+            num += "."
+        ind += str(i) if p & 4 else "_"
+    return f"|{num}| {ind}"
+
+class DisplayWatcher:
+    def __init__(self, callback=None):
+        # Without a callback the events are collected in events.
+        self.callback = callback
+        self.events = []
+        self.digest = None
+
+    def attach(self, e):
+        self.digest = display_digest(e)
+        e.hooks.append(self)
+        return self
+
+    def detach(self, e):
+        e.hooks.remove(self)
+
+    def __call__(self, e):
+        digest = display_digest(e)
+        if digest == self.digest:
+            return
+        self.digest = digest
+        event = DisplayEvent(e.steps, digest, display_text(e))
+        if self.callback is None:
+            self.events.append(event)
+        else:
+            self.callback(event)
+
+    def drain(self):
+        events = self.events
+        self.events = []
+        return events
+
+def display_events(e, until=(), max_steps=None, events=(), chunk=100000):
+    # Runs the emulator as Emulator.run and yields the DisplayEvents, in
+    # chunks of steps. Without max_steps and events it runs until a break
+    # or until the calculator is idle, and yields them at the end.
+    watcher = DisplayWatcher().attach(e)
+    events = list(events)
+    try:
+        while True:
+            if max_steps is None and not events:
+                limit = None
+            else:
+                limit = e.steps + chunk
+                if max_steps is not None:
+                    limit = min(limit, max_steps)
+            res = e.run(until, limit, events)
+            events = [ev for ev in events if ev[0] > e.steps]
+            yield from watcher.drain()
+            if res != "limit" or (max_steps is not None
+                                  and e.steps >= max_steps):
+                return
+    finally:
+        watcher.detach(e)
+
+def key_events(keys, start, gap=100000):
+    # Events for Emulator.run pressing each key for gap steps and
+    # releasing it for gap steps, starting at step start.
+    res = []
+    for k, key in enumerate(keys):
+        res.append((start + 2 * k * gap, key))
+        res.append((start + (2 * k + 1) * gap, 0))
+    return res
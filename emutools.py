@@ -0,0 +1,218 @@
+# Extensions of the emulator from the mk51fx2500re repository used by the
+# analysis scripts.
+
+import copy
+import functools
+import hashlib
+import os
+import pickle
+import sys
+
+RE_REPOSITORY = "mk51fx2500re"
+if RE_REPOSITORY not in sys.path:
+    sys.path.insert(0, RE_REPOSITORY)
+
+import emulator
+from calculator import execute_seq
+from program import Program
+from registers import RegisterFile
+
+ROM_PATH = "mk51fx2500rom.txt"
+
+# The keyboard scan loop in which the calculator waits for a key.
+KEYSCAN = 0x3c5
+
+# Attributes that count or observe what happened and are not part of the
+# machine state.
+NOT_STATE = {"steps", "hooks", "hle", "last_depth"}
+
+# How many distinct states at KEYSCAN run() remembers to find the idle cycle.
+IDLE_STATES = 1024
+
+class Emulator(emulator.Emulator):
+    # until() and cont() go through run(), so they skip idle scan loop
+    # cycles. Relies on the call() of the base class running the machine
+    # through step().
+    def __init__(self, *args, packed=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        if packed:
+            self.regs = RegisterFile(self.regs)
+        self.steps = 0
+        # Called with the emulator after every step.
+        self.hooks = []
+        # Optional hle.Hle running known subroutines without interpreting
+        # them.
+        self.hle = None
+        # Depth of the return stack after the last step, to tell whether
+        # the pc was reached by a call.
+        self.last_depth = len(self.stack)
+
+    def step(self):
+        n = None
+        if (self.hle is not None and self.pc in self.hle.handlers
+                and len(self.stack) > self.last_depth):
+            n = self.hle.enter(self)
+        if n is None:
+            super().step()
+            n = 1
+        self.last_depth = len(self.stack)
+        self.steps += n
+        for hook in self.hooks:
+            hook(self)
+
+    def fork(self):
+        # Copy of the whole machine state (registers, pc, stack, flags,
+        # keycode, breakpoints). The program and the hle are shared, not
+        # copied, and the copy has no hooks.
+        memo = {id(v): v for v in vars(self).values()
+                if isinstance(v, Program)}
+        memo[id(self.hooks)] = []
+        memo[id(self.hle)] = self.hle
+        return copy.deepcopy(self, memo)
+
+    def until(self, addr):
+        # Like the base class, but returns "idle" instead of running
+        # forever when addr is not reached with no key pressed. Already at
+        # addr the base class decides whether to step.
+        if self.pc == addr:
+            return super().until(addr)
+        return self.run(until=[addr])
+
+    def cont(self):
+        # Steps off the current address and runs to the next breakpoint.
+        self.step()
+        return self.run(until=self.breakpoints)
+
+    def run(self, until=(), max_steps=None, events=()):
+        # Steps until pc is in until or self.steps reaches max_steps.
+        # events are (steps, keycode) pairs, sorted by steps, setting the
+        # keycode when the counter reaches steps.
+        #
+        # With no key pressed the calculator cycles through the same states
+        # in the scan loop. Once run() has seen a state at KEYSCAN twice and
+        # none of the until addresses is on the cycle, it skips whole
+        # cycles up to the next event or max_steps, adding the skipped
+        # steps to the counter. With neither left it returns "idle" instead
+        # of running forever. Otherwise it returns "break" or "limit".
+        # Hooks are not called for the skipped steps.
+        until = set(until)
+        events = list(events)
+        seen = {}
+        pcs = []
+        while True:
+            while events and events[0][0] <= self.steps:
+                self.keycode = events.pop(0)[1]
+                seen.clear()
+                pcs.clear()
+            if self.pc in until:
+                return "break"
+            if max_steps is not None and self.steps >= max_steps:
+                return "limit"
+            if self.pc == KEYSCAN and not self.keycode:
+                key = state_key(self)
+                if key in seen:
+                    start = seen[key]
+                    cycle = set().union(*pcs[start[1]:])
+                    if not until & cycle:
+                        limits = [s for s, k in events[:1]]
+                        if max_steps is not None:
+                            limits.append(max_steps)
+                        if not limits:
+                            return "idle"
+                        period = self.steps - start[0]
+                        skip = (min(limits) - self.steps) // period
+                        self.steps += skip * period
+                    seen.clear()
+                    pcs.clear()
+                    continue
+                elif len(seen) >= IDLE_STATES:
+                    seen.clear()
+                    pcs.clear()
+                seen[key] = (self.steps, len(pcs))
+                pcs.append(set())
+            if pcs:
+                pcs[-1].add(self.pc)
+            self.step()
+
+def rom_hash(path=ROM_PATH):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+# Parsed programs by the hash of the ROM file. They are shared by all the
+# emulators of the process and must not be modified.
+programs = {}
+
+CACHE_DIR = ".cache"
+
+def program_hash():
+    # Hash of the ROM and of the source of the module defining Program, so
+    # that a cached Program isn't used after either changes.
+    h = hashlib.sha1(rom_hash().encode())
+    with open(sys.modules[Program.__module__].__file__, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+def program(cache_dir=CACHE_DIR):
+    # The text dump is parsed once and the Program pickled in cache_dir,
+    # keyed by program_hash(), so other processes only unpickle it.
+    key = rom_hash()
+    if key not in programs:
+        path = os.path.join(cache_dir,
+                            f"program-{program_hash()[:16]}.pickle")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                programs[key] = pickle.load(f)
+        else:
+            programs[key] = Program.from_file()
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(programs[key], f)
+            os.replace(tmp, path)
+    return programs[key]
+
+def create_emulator(packed=False):
+    # packed: store the registers in a RegisterFile instead of lists.
+    return Emulator(program(), packed=packed)
+
+@functools.lru_cache(maxsize=None)
+def keyscan_state(prefix):
+    # Only used as a template for fork(), it must not be run.
+    e = create_emulator()
+    if prefix:
+        execute_seq(e, list(prefix), print_disp=False)
+    e.keycode = 0
+    e.until(KEYSCAN)
+    return e
+
+def at_keyscan(prefix=()):
+    # Emulator that has executed the prefix keys and is waiting in the
+    # scan loop with no key pressed. The state for each prefix is computed
+    # once and then forked.
+    return keyscan_state(tuple(prefix)).fork()
+
+def emulated_seconds(steps, clock_hz, cycles_per_step):
+    # Time of the steps on a calculator in which every instruction takes
+    # cycles_per_step cycles of a clock_hz clock. There are no measured
+    # figures for the MK-51 and fx-2500 here, so they must be given.
+    return steps * cycles_per_step / clock_hz
+
+def machine_state(e):
+    # Everything that the next steps can depend on, for comparisons.
+    return {k: v for k, v in vars(e).items()
+            if not isinstance(v, Program) and k not in NOT_STATE}
+
+def state_key(e):
+    # Bytes identifying the machine state, the same with both kinds of
+    # registers.
+    state = machine_state(e)
+    regs = state.pop("regs")
+    if not isinstance(regs, RegisterFile):
+        regs = RegisterFile(regs)
+    return regs.packed() + pickle.dumps(state)
+
+def state_diff(a, b):
+    sa = machine_state(a)
+    sb = machine_state(b)
+    return {k: (sa.get(k), sb.get(k)) for k in sa.keys() | sb.keys()
+            if sa.get(k) != sb.get(k)}
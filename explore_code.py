@@ -4,14 +4,13 @@ RE_REPOSITORY = "mk51fx2500re"
 if RE_REPOSITORY not in sys.path:
     sys.path.insert(0, RE_REPOSITORY)
 
-from emulator import Emulator
 from keys import *
-from program import Program
 from analyze import decode_instr
 from calculator import execute_seq, decode_num
-
-def create_emulator():
-    return Emulator(Program.from_file())
+from display import display_text
+from emutools import KEYSCAN, at_keyscan, create_emulator, emulated_seconds
+from rom_profile import Profiler
+from tracing import Trace
 
 def reg_str(r):
     return "".join(f"{d:x}" for d in reversed(r))
@@ -46,13 +45,13 @@ def test_tan_cordic():
 
 def get_key_trace(e, key):
     e.keycode = 0
-    e.until(0x3c5)
+    e.until(KEYSCAN)
     e.keycode = key
-    trace = []
+    trace = Trace(capacity=200).attach(e)
     for i in range(200):
         e.step()
-        trace.append(e.pc)
-    return trace
+    trace.detach(e)
+    return trace.pcs()[1].tolist()
 
 class KeyEntry:
     def __init__(self, desc):
@@ -108,60 +107,80 @@ key_entries = {
     0x3df: KeyEntry("F2"),
 }
 
+PREFIX_NAMES = ["", "INV", "F1", "F2", "SD", "SD INV", "SD F2"]
+PREFIXES = [[], [KINV], [KF1], [KF2], [KINV, KMODE],
+            [KINV, KMODE, KINV], [KINV, KMODE, KF2]]
+KEYS = [row * 10 + col for row in range(8) for col in range(1, 6)]
+
+def describe_key(key, prefix=(), setup=()):
+    e = at_keyscan(list(setup) + list(prefix))
+    e.keycode = key
+    for i in range(200):
+        e.step()
+        if e.pc in key_entries:
+            return key_entries[e.pc].describe(e)
+    return "???"
+
 def describe_key_entries():
-    print("   ",
-          " ".join(f"{prefix:9s}"
-                   for prefix in ["", "INV", "F1", "F2",
-                                  "SD", "SD INV", "SD F2"]))
-    for row in range(8):
-        for col in range(1, 6):
-            key = row * 10 + col
-            ent = []
-            for prefix in [[], [KINV], [KF1], [KF2], [KINV, KMODE],
-                           [KINV, KMODE, KINV], [KINV, KMODE, KF2]]:
-                emul = create_emulator()
-                execute_seq(emul, prefix, print_disp=False)
-                emul.keycode = 0
-                emul.until(0x3c5)
-                emul.keycode = key
-                for i in range(200):
-                    emul.step()
-                    if emul.pc in key_entries:
-                        ent.append(key_entries[emul.pc].describe(emul))
-                        break
-                else:
-                    ent.append("???")
-            estr = " ".join(f"{d:9s}" for d in ent)
-            print(f"{key:-2d}: {estr}")
-
-def display(e):
-    num = ""
-    ind = ""
-    for i in range(9):
-        d = e.regs[0][12 - i]
-        if d <= 9:
-            num += str(d)
-        elif d == 13:
-            num += "E"
-        elif d == 14:
-            num += "-"
-        else:
-            num += " "
-        p = e.regs[1][12 - i]
-        if p & 8:
-            num += "."
-        ind += str(i) if p & 4 else "_"
-    return f"|{num}| {ind}"
+    print("   ", " ".join(f"{prefix:9s}" for prefix in PREFIX_NAMES))
+    for key in KEYS:
+        ent = [describe_key(key, prefix) for prefix in PREFIXES]
+        estr = " ".join(f"{d:9s}" for d in ent)
+        print(f"{key:-2d}: {estr}")
+
+# Keys entering the argument of the functions timed by key_latency_table.
+LATENCY_SETUP = [K4, K5]
+LATENCY_LIMIT = 10000000
+
+def key_latency(key, prefix=(), setup=LATENCY_SETUP):
+    # Steps from pressing the key, after the setup and prefix keys, until
+    # the calculator is back in the scan loop, as in execute_seq. None if
+    # it doesn't get back within LATENCY_LIMIT steps.
+    e = at_keyscan(list(setup) + list(prefix))
+    start = e.steps
+    e.keycode = key
+    e.step()
+    if e.run(until=[KEYSCAN], max_steps=start + LATENCY_LIMIT) != "break":
+        return None
+    return e.steps - start
+
+def key_latency_table(keys=KEYS, prefixes=PREFIXES, setup=LATENCY_SETUP,
+                      clock_hz=None, cycles_per_step=None):
+    # Latency of each key after each prefix, with the function of the key.
+    # In ms given the clock rate and the cycles per instruction of the
+    # calculator, in steps otherwise.
+    print("   ", " ".join(f"{prefix:18s}" for prefix in PREFIX_NAMES))
+    for key in keys:
+        cells = []
+        for prefix in prefixes:
+            steps = key_latency(key, prefix, setup)
+            if steps is None:
+                t = "-"
+            elif clock_hz is None:
+                t = str(steps)
+            else:
+                ms = 1000 * emulated_seconds(steps, clock_hz,
+                                             cycles_per_step)
+                t = f"{ms:.1f}"
+            cells.append(f"{describe_key(key, prefix, setup):9s} {t:>8s}")
+        print(f"{key:-2d}: {' '.join(cells)}")
+
+def profile_key_entries(keys=KEYS, prefixes=PREFIXES):
+    # Profile of pressing each of the keys after each of the prefixes.
+    prof = Profiler()
+    for key in keys:
+        for prefix in prefixes:
+            e = at_keyscan(prefix)
+            prof.attach(e)
+            execute_seq(e, [key], print_disp=False)
+            prof.detach(e)
+    return prof
 
 def get_disp_after_keys():
     for row in range(8):
         for col_code in range(1, 15):
             if col_code >= 4 and col_code & 3 != 0: continue
-            e = create_emulator()
-            e.add_break(0x3c5)
-            e.cont()
-            e.del_all_breaks()
+            e = at_keyscan()
             e.keycode = (row, col_code)
-            e.add_break(0x3c3)
-            e.cont()
-            print(row, f"{col_code:x}", display(e))
+            e.run(until=[0x3c3])
+            print(row, f"{col_code:x}", display_text(e))
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+
+# Breadth-first search of the states the calculator can reach by pressing
+# keys. Starting from the idle state, every key of KEYS is pressed and
+# released in every new state, and each resulting state is identified by a
+# hash of its machine state (emutools.state_key), so only states not seen
+# before are expanded.
+#
+# The search is kept in a directory, so it can be stopped and resumed:
+#   states.bin  for each state found, in the order found: hash, size and
+#               the zlib-compressed pickle of its machine state
+#   edges.bin   for each expanded state: its hash, the number of keys and
+#               for each key the key code and the hash of the next state
+#               (STUCK if the calculator didn't get back to the scan loop)
+# Only the hashes are kept in memory. The states of the frontier are read
+# from states.bin when they are expanded.
+
+import argparse
+import hashlib
+import os
+import pickle
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from emutools import (KEYSCAN, at_keyscan, create_emulator, machine_state,
+                      state_key)
+from explore_code import KEYS
+
+HASH_SIZE = 16
+STUCK = bytes(HASH_SIZE)
+STATE = struct.Struct(f"<{HASH_SIZE}sI")
+EDGES = struct.Struct(f"<{HASH_SIZE}sH")
+EDGE = struct.Struct(f"<H{HASH_SIZE}s")
+
+# Steps after which a key press that hasn't got back to the scan loop is
+# considered stuck.
+PRESS_LIMIT = 1000000
+# Most states at KEYSCAN searched for the idle cycle by canonical().
+CYCLE_LIMIT = 256
+
+def state_hash(e):
+    return hashlib.blake2b(state_key(e), digest_size=HASH_SIZE).digest()
+
+def pack_state(e):
+    return zlib.compress(pickle.dumps(machine_state(e)))
+
+def unpack_state(data):
+    e = create_emulator()
+    for k, v in pickle.loads(zlib.decompress(data)).items():
+        setattr(e, k, v)
+    return e
+
+def to_keyscan(e):
+    e.step()
+    return e.run(until=[KEYSCAN], max_steps=e.steps + PRESS_LIMIT) == "break"
+
+def press(e, key):
+    # Presses and releases the key, as execute_seq. False if the
+    # calculator doesn't get back to the scan loop.
+    e.keycode = key
+    if not to_keyscan(e):
+        return False
+    e.keycode = 0
+    return to_keyscan(e)
+
+def canonical(e):
+    # With no key pressed the calculator cycles through a few states at
+    # KEYSCAN (see Emulator.run), so the state after a key depends on when
+    # it was released. The passes through the scan loop are followed until
+    # a state repeats, and the state of the cycle with the smallest hash
+    # stands for all of them. The states before the cycle are left out, as
+    # they are only reached from some of its states. If no state repeats
+    # in CYCLE_LIMIT passes or the calculator leaves the scan loop, the
+    # state is kept as it is.
+    start = e.fork()
+    seen = {}
+    hashes = []
+    for i in range(CYCLE_LIMIT):
+        h = state_hash(e)
+        if h in seen:
+            cycle = hashes[seen[h]:]
+            # e is at the start of the cycle again.
+            for j in range(cycle.index(min(cycle))):
+                to_keyscan(e)
+            return min(cycle), e
+        seen[h] = len(hashes)
+        hashes.append(h)
+        if not to_keyscan(e):
+            break
+    return hashes[0], start
+
+def expand(data, keys):
+    # (key, hash, packed state) of the states after each key.
+    start = unpack_state(data)
+    res = []
+    for key in keys:
+        e = start.fork()
+        if press(e, key):
+            h, e = canonical(e)
+            res.append((key, h, pack_state(e)))
+        else:
+            res.append((key, STUCK, None))
+    return res
+
+def init_worker():
+    create_emulator()
+
+class Explorer:
+    def __init__(self, path, keys=KEYS):
+        self.path = path
+        self.keys = list(keys)
+        os.makedirs(path, exist_ok=True)
+        # Hash -> offset of the state in states.bin.
+        self.offsets = {}
+        self.frontier = deque()
+        self.expanded = 0
+        self.load()
+        if not self.offsets:
+            h, e = canonical(at_keyscan())
+            self.add_state(h, pack_state(e))
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def load(self):
+        found = []
+        expanded = set()
+        # A search stopped while writing can leave a partial record at the
+        # end of a file, which is cut off.
+        if os.path.exists(self.file("states.bin")):
+            with open(self.file("states.bin"), "rb") as f:
+                end = 0
+                for h, offset in read_states(f):
+                    self.offsets[h] = offset
+                    found.append(h)
+                    end = f.tell()
+            os.truncate(self.file("states.bin"), end)
+        if os.path.exists(self.file("edges.bin")):
+            with open(self.file("edges.bin"), "rb") as f:
+                end = 0
+                for src, edges in read_edges(f):
+                    expanded.add(src)
+                    end = f.tell()
+            os.truncate(self.file("edges.bin"), end)
+        self.expanded = len(expanded)
+        self.frontier.extend(h for h in found if h not in expanded)
+        self.states = open(self.file("states.bin"), "ab")
+        self.edges = open(self.file("edges.bin"), "ab")
+
+    def add_state(self, h, data):
+        self.offsets[h] = self.states.tell()
+        self.states.write(STATE.pack(h, len(data)))
+        self.states.write(data)
+        self.frontier.append(h)
+
+    def run(self, max_states=None, workers=None, batch=1024):
+        # Expands states until the frontier is empty or max_states states
+        # have been expanded in total.
+        with ProcessPoolExecutor(workers, initializer=init_worker) as ex:
+            while self.frontier and (max_states is None
+                                     or self.expanded < max_states):
+                n = len(self.frontier)
+                if max_states is not None:
+                    n = min(n, max_states - self.expanded)
+                srcs = [self.frontier.popleft() for i in range(min(n, batch))]
+                self.states.flush()
+                with open(self.file("states.bin"), "rb") as f:
+                    datas = [read_state(f, self.offsets[h]) for h in srcs]
+                results = ex.map(expand, datas, [self.keys] * len(srcs),
+                                 chunksize=16)
+                for src, edges in zip(srcs, results):
+                    for key, h, data in edges:
+                        if h != STUCK and h not in self.offsets:
+                            self.add_state(h, data)
+                    # The new states must be on disk before the state is
+                    # recorded as expanded.
+                    self.states.flush()
+                    self.edges.write(EDGES.pack(src, len(edges)) + b"".join(
+                        EDGE.pack(key, h) for key, h, data in edges))
+                    self.expanded += 1
+                self.edges.flush()
+
+    def close(self):
+        self.states.close()
+        self.edges.close()
+
+def read_states(f):
+    # (hash, offset) of the states in a states.bin.
+    while True:
+        offset = f.tell()
+        header = f.read(STATE.size)
+        if len(header) < STATE.size:
+            return
+        h, size = STATE.unpack(header)
+        if len(f.read(size)) < size:
+            return
+        yield h, offset
+
+def read_state(f, offset):
+    f.seek(offset)
+    _, size = STATE.unpack(f.read(STATE.size))
+    return f.read(size)
+
+def read_edges(f):
+    # (hash, [(key, next hash)]) of the expanded states in an edges.bin.
+    while True:
+        header = f.read(EDGES.size)
+        if len(header) < EDGES.size:
+            return
+        src, n = EDGES.unpack(header)
+        data = f.read(n * EDGE.size)
+        if len(data) < n * EDGE.size:
+            return
+        yield src, list(EDGE.iter_unpack(data))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--max-states", type=int)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+    ex = Explorer(args.path)
+    ex.run(args.max_states, args.workers)
+    print(f"{len(ex.offsets)} states found, {ex.expanded} expanded, "
+          f"{len(ex.frontier)} in the frontier")
+    ex.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# High-level emulation of pure ROM subroutines.
+#
+# An Hle object set as Emulator.hle replaces the execution of the
+# subroutines in ROUTINES: when a call has just entered one of them, the
+# emulator applies the effect of the routine and returns to the caller in
+# a single call of step(), adding the steps the routine takes to the
+# counter. Code that runs into an entry address without a call is
+# interpreted.
+#
+# The effect of a routine is every register digit and flag it writes,
+# captured by interpreting it from a set of reachable states. A routine is
+# only handled if it writes the same values from all of them and takes the
+# same number of steps, which is the case for the routines that load
+# constants. The others, such as addr01, are left to the interpreter;
+# arith_harness.py checks their results against a Decimal model instead.
+# A write of the value that a digit or flag already has in every capture
+# state is not seen.
+#
+# In shadow mode every handled call is interpreted on one fork and handled
+# on another. The emulator continues with the interpreted state, and calls
+# after which the two forks differ are recorded in divergences with the
+# difference of the whole machine state.
+
+import functools
+
+from emutools import at_keyscan, create_emulator, machine_state, state_diff
+from keys import *
+
+# Entry address -> name.
+ROUTINES = {
+    0x0d4: "pi_to_r0",
+    0x277: "pi_180_to_r1",
+    0x26c: "ln10_to_r1",
+    0x250: "set_r1_to_09",
+    0x018: "set_r1_to_45",
+    0x01e: "one_to_r1",
+}
+
+# Keys giving the states in which the effects are captured, after a cold
+# emulator.
+CAPTURE_KEYS = [[], [K4, K5], [KINV], [KF1], [KF2], [KINV, KMODE]]
+
+class Effect:
+    def __init__(self, digits, attrs, steps):
+        # (reg, digit) -> value and attribute -> value written, and the
+        # number of steps from the entry to the return.
+        self.digits = digits
+        self.attrs = attrs
+        self.steps = steps
+
+    def apply(self, e):
+        # Writes the effect and returns to the caller.
+        for (r, i), v in self.digits.items():
+            e.regs[r][i] = v
+        for k, v in self.attrs.items():
+            setattr(e, k, v)
+        e.pc = e.stack.pop()
+
+def flags(e):
+    return {k: v for k, v in machine_state(e).items()
+            if k not in ("regs", "pc", "stack")}
+
+def interpret(e, addr):
+    # Calls addr on e as if from a call instruction, returning the steps.
+    e.stack.append(0)
+    e.pc = addr
+    depth = len(e.stack)
+    start = e.steps
+    while len(e.stack) >= depth:
+        e.step()
+    return e.steps - start
+
+@functools.lru_cache(maxsize=None)
+def capture(addr):
+    # Effect of the routine at addr, or None if it depends on the state.
+    runs = []
+    for e in [create_emulator()] + [at_keyscan(k) for k in CAPTURE_KEYS]:
+        regs = [list(r) for r in e.regs]
+        attrs = flags(e)
+        steps = interpret(e, addr)
+        runs.append((regs, attrs, [list(r) for r in e.regs], flags(e),
+                     steps))
+    digits = {(r, i) for regs, _, post, _, _ in runs
+              for r in range(8) for i in range(15)
+              if post[r][i] != regs[r][i]}
+    names = {k for _, attrs, _, post, _ in runs for k in post
+             if post[k] != attrs.get(k)}
+    effects = {(tuple((r, i, post[r][i]) for r, i in sorted(digits)),
+                tuple((k, post_attrs[k]) for k in sorted(names)), steps)
+               for _, _, post, post_attrs, steps in runs}
+    if len(effects) != 1:
+        return None
+    [(d, a, steps)] = effects
+    return Effect({(r, i): v for r, i, v in d}, dict(a), steps)
+
+class Divergence:
+    def __init__(self, addr, steps, diff):
+        self.addr = addr
+        # Value of the step counter at the call.
+        self.steps = steps
+        # state_diff of the handled and the interpreted call.
+        self.diff = diff
+
+    def __repr__(self):
+        return (f"Divergence({ROUTINES[self.addr]} at step {self.steps}: "
+                f"{self.diff})")
+
+class Hle:
+    def __init__(self, names=None, shadow=False):
+        # names: the routines to handle, all by default. Routines whose
+        # effect can't be captured are not handled.
+        self.handlers = {}
+        for addr, name in ROUTINES.items():
+            if names is None or name in names:
+                effect = capture(addr)
+                if effect is not None:
+                    self.handlers[addr] = effect
+        self.shadow = shadow
+        self.calls = {}
+        self.divergences = []
+
+    def enter(self, e):
+        # Executes the call at e.pc and returns the number of steps it took.
+        addr = e.pc
+        effect = self.handlers[addr]
+        self.calls[addr] = self.calls.get(addr, 0) + 1
+        if not self.shadow:
+            effect.apply(e)
+            return effect.steps
+        fast = e.fork()
+        effect.apply(fast)
+        rom = e.fork()
+        rom.hle = None
+        depth = len(e.stack)
+        while len(rom.stack) >= depth:
+            rom.step()
+        # state_diff leaves out the step counters, which are compared here.
+        diff = state_diff(fast, rom)
+        if rom.steps - e.steps != effect.steps:
+            diff["steps"] = (effect.steps, rom.steps - e.steps)
+        if diff:
+            self.divergences.append(Divergence(addr, e.steps, diff))
+        for k, v in machine_state(rom).items():
+            setattr(e, k, v)
+        return rom.steps - e.steps
@@ -1,16 +1,26 @@
 #!/usr/bin/python3
 
+import functools
+import hashlib
 import imageio
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+import rom_format
 import scipy.ndimage
 import typing
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
+from multiprocessing import shared_memory
 
 NROWS = 16 * 5
 NCOLS = 16 * 22
 
+GAUSS_SIGMA = 2
+# Support of laplace followed by gaussian_filter with the default truncate.
+FILTER_MARGIN = 1 + int(4.0 * GAUSS_SIGMA + 0.5)
+
 FIXES = {
     (0, 12): 0,
     (1, 15): 0,
@@ -100,8 +110,18 @@ class ImageDesc:
 @dataclass
 class Image:
     desc: ImageDesc
-    img: np.ndarray
+    img: typing.Optional[np.ndarray]
     gray: np.ndarray
+    # Position (row, col) of gray[0, 0] in the full image.
+    origin: typing.Tuple[int, int] = (0, 0)
+    # Hash of gray, computed by image_digest.
+    digest: typing.Optional[str] = None
+
+    def rgb(self):
+        # img is not loaded when gray comes from the cache.
+        if self.img is None:
+            self.img = imageio.imread(self.desc.path)
+        return self.img
 
 # From https://x.com/travisgoodspeed/status/1683224934967828480
 MK51_ROM = ImageDesc(
@@ -154,57 +174,145 @@ MK51_GH = ImageDesc(
                     [(1303.2, 2600.1), (8537.1, 2583.3)]])
 
 
-def load_image(desc):
-    img = imageio.imread(desc.path)
+def preprocess(img, dtype=np.float64):
     # gray = np.mean(img, axis=-1)
-    gray = scipy.ndimage.gaussian_filter(
-        scipy.ndimage.laplace(np.mean(img, axis=-1)), 2)
-    return Image(desc, img, gray)
+    return scipy.ndimage.gaussian_filter(
+        scipy.ndimage.laplace(np.mean(img, axis=-1, dtype=dtype)),
+        GAUSS_SIGMA)
+
+def patch_radius(desc):
+    return desc.width * 5 // 4096
+
+def rom_bounds(desc):
+    # Part of the image that the bits are sampled from, with room for the
+    # normalisation neighbourhoods and the filters.
+    corners = np.reshape([desc.rows_corners, desc.cols_corners], (-1, 2))
+    margin = FILTER_MARGIN + 10 * max(patch_radius(desc), 3) + 2
+    x0, y0 = np.floor(corners.min(axis=0)).astype(int) - margin
+    x1, y1 = np.ceil(corners.max(axis=0)).astype(int) + margin + 1
+    return (int(max(y0, 0)), int(min(y1, desc.height)),
+            int(max(x0, 0)), int(min(x1, desc.width)))
+
+def gray_cache_path(desc, cache_dir, bounds, dtype):
+    st = os.stat(desc.path)
+    key = repr((os.path.abspath(desc.path), st.st_mtime_ns, st.st_size,
+                GAUSS_SIGMA, bounds, np.dtype(dtype).str))
+    name = os.path.splitext(os.path.basename(desc.path))[0]
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{name}-{digest}.npy")
+
+def load_image(desc, crop=False, cache_dir=None):
+    # With crop=True only the ROM area is filtered, in float32. With
+    # cache_dir the filtered array is saved there and memory-mapped on
+    # later loads.
+    if crop:
+        bounds = rom_bounds(desc)
+        dtype = np.float32
+    else:
+        bounds = (0, desc.height, 0, desc.width)
+        dtype = np.float64
+    origin = (bounds[0], bounds[2])
+    if cache_dir is not None:
+        path = gray_cache_path(desc, cache_dir, bounds, dtype)
+        if os.path.exists(path):
+            return Image(desc, None, np.load(path, mmap_mode="r"), origin)
 
-def bit_pos(desc, i, j):
-    def interp(a, b, k, n):
-        return a + (b - a) * k / n
+    img = imageio.imread(desc.path)
+    gray = preprocess(img[bounds[0]:bounds[1], bounds[2]:bounds[3]], dtype)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, gray)
+        os.replace(tmp, path)
+        gray = np.load(path, mmap_mode="r")
+    return Image(desc, img, gray, origin)
+
+def corners_key(desc):
+    return tuple(float(v) for v in np.ravel(
+        [desc.rows_corners, desc.cols_corners]))
+
+
+@functools.lru_cache(maxsize=16)
+def corners_lattice(key):
+    rc = np.array(key[:8]).reshape(2, 2, 2)
+    cc = np.array(key[8:]).reshape(2, 2, 2)
+    ki = np.arange(NROWS)[:, None] / (NROWS - 1)
+    kj = np.arange(NCOLS)[:, None] / (NCOLS - 1)
+    # Row i is the line through a and b, column j the line through c and d.
+    a = (rc[0][0] + (rc[1][0] - rc[0][0]) * ki)[:, None, :]
+    b = (rc[0][1] + (rc[1][1] - rc[0][1]) * ki)[:, None, :]
+    c = (cc[0][0] + (cc[0][1] - cc[0][0]) * kj)[None, :, :]
+    d = (cc[1][0] + (cc[1][1] - cc[1][0]) * kj)[None, :, :]
+    ab = b - a
+    dc = c - d
+    ac = c - a
+    det = ab[..., 0] * dc[..., 1] - ab[..., 1] * dc[..., 0]
+    t = (ac[..., 0] * dc[..., 1] - ac[..., 1] * dc[..., 0]) / det
+    res = a + ab * t[..., None]
+    res.setflags(write=False)
+    return res
 
-    def point(a, b, k, n):
-        return tuple([interp(a[t], b[t], k, n - 1) for t in range(2)])
 
-    def intersection(a, b, c, d):
-        m = np.array([
-            [b[0] - a[0], c[0] - d[0]],
-            [b[1] - a[1], c[1] - d[1]]])
-        r = np.array([c[0] - a[0], c[1] - a[1]])
-        t = np.linalg.solve(m, r)
-        return (a[0] * (1 - t[0]) + b[0] * t[0],
-                a[1] * (1 - t[0]) + b[1] * t[0])
+def bit_lattice(desc):
+    # (NROWS, NCOLS, 2) array of (x, y) positions of all bits.
+    return corners_lattice(corners_key(desc))
 
-    return intersection(
-        point(desc.rows_corners[0][0], desc.rows_corners[1][0], i, NROWS),
-        point(desc.rows_corners[0][1], desc.rows_corners[1][1], i, NROWS),
-        point(desc.cols_corners[0][0], desc.cols_corners[0][1], j, NCOLS),
-        point(desc.cols_corners[1][0], desc.cols_corners[1][1], j, NCOLS))
 
+def bit_pos(desc, i, j):
+    return tuple(bit_lattice(desc)[i, j])
+
+
+# Maximum number of pixels sampled in one map_coordinates call.
+SAMPLE_CHUNK = 1 << 24
+
+
+def sample_patches(gray, pos, r):
+    # Same sampling as affine_transform with an identity matrix and offset
+    # (y - r, x - r), done for all (x, y) positions at once.
+    off = np.arange(2 * r) - r
+    res = np.empty((len(pos), 2 * r, 2 * r), dtype=gray.dtype)
+    step = max(1, SAMPLE_CHUNK // (4 * r * r))
+    for s in range(0, len(pos), step):
+        p = pos[s:s + step]
+        ys = p[:, 1, None, None] + off[None, :, None]
+        xs = p[:, 0, None, None] + off[None, None, :]
+        ys, xs = np.broadcast_arrays(ys, xs)
+        res[s:s + step] = scipy.ndimage.map_coordinates(
+            gray, (ys, xs), order=3, prefilter=False)
+    return res
 
-def get_area(image, i, j, r, norm=False):
-    if norm:
-        neighb = get_area(image, i, j, 10 * r, norm=False)
-        area = get_area(image, i, j, r, norm=False)
-        return (area - np.mean(neighb)) / np.std(neighb)
-
-    x, y = bit_pos(image.desc, i, j)
-    res = scipy.ndimage.affine_transform(
-        image.gray, [1, 1], offset=(y - r, x - r), output_shape=(2 * r, 2 * r),
-        prefilter=False)
+
+def get_areas(image, rows, cols, r, norm=False):
+    rows = np.asarray(rows).ravel()
+    cols = np.asarray(cols).ravel()
+    pos = bit_lattice(image.desc)[rows, cols] - image.origin[::-1]
+    if not norm:
+        return sample_patches(image.gray, pos, r)
+
+    # The neighbourhoods are 100 times bigger than the areas, so they are
+    # sampled and reduced a chunk at a time.
+    res = np.empty((len(pos), 2 * r, 2 * r), dtype=image.gray.dtype)
+    step = max(1, SAMPLE_CHUNK // (400 * r * r))
+    for s in range(0, len(pos), step):
+        p = pos[s:s + step]
+        neighb = sample_patches(image.gray, p, 10 * r)
+        area = sample_patches(image.gray, p, r)
+        mean = np.mean(neighb, axis=(1, 2))[:, None, None]
+        std = np.std(neighb, axis=(1, 2))[:, None, None]
+        res[s:s + step] = (area - mean) / std
     return res
 
 
+def get_area(image, i, j, r, norm=False):
+    return get_areas(image, [i], [j], r, norm=norm)[0]
+
+
 def get_random_bits(image):
     n = 500
     rows = np.random.randint(0, NROWS, n)
     cols = np.random.randint(0, NCOLS, n)
-    res = []
-    for r, c in zip(rows, cols):
-        res.append(get_area(image, r, c, 3).flatten())
-    return np.array(res)
+    return get_areas(image, rows, cols, 3).reshape(n, -1)
 
 
 def pca_bits(bits):
@@ -242,46 +350,86 @@ C1 = np.array([-0.04704893, -0.09579545, -0.22798194, -0.28930118, -0.18566232,
               0.10222208])
 THR = 27
 
-def read_bits(image):
-    res = np.zeros((NROWS, NCOLS), dtype=bool)
-    for i in range(NROWS):
-        for j in range(NCOLS):
-            ar = get_area(image, i, j, 3).flatten()
-            # TODO: classify 0/1 based on one example
-            res[i, j] = np.dot(ar - M, C1) < THR
+def pca_score_map(image):
+    # Projection on C1 of the 6x6 patch around every pixel. Sampling it at a
+    # bit position gives the same value as projecting the interpolated
+    # patch, since interpolation commutes with the correlation.
+    k = C1.reshape(6, 6).astype(image.gray.dtype)
+    return (scipy.ndimage.correlate(image.gray, k, mode="constant")
+            - np.dot(M, C1))
+
+def pca_scores(image, score_map=None):
+    # Scores of all bits and the score map they were sampled from. The
+    # bits are the scores below THR.
+    if score_map is None:
+        score_map = pca_score_map(image)
+    pos = bit_lattice(image.desc) - image.origin[::-1]
+    scores = scipy.ndimage.map_coordinates(
+        score_map, (pos[..., 1], pos[..., 0]), order=3, prefilter=False)
+    return scores, score_map
+
+def read_bits(image, mode="correlate"):
+    if mode == "correlate":
+        scores, score_map = pca_scores(image)
+        res = scores < THR
+    elif mode == "patches":
+        rows, cols = np.indices((NROWS, NCOLS)).reshape(2, -1)
+        ar = get_areas(image, rows, cols, 3).reshape(len(rows), -1)
+        res = (np.dot(ar - M, C1) < THR).reshape(NROWS, NCOLS)
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+    # TODO: classify 0/1 based on one example
     return res.astype(int)
 
-def dist_from_means(bits, m):
-    d = []
-    for i in range(2):
-        d.append(np.sum(np.square(bits - m[i]), axis=-1))
-    return np.array(d)
-
-def kmeans(bits, m0, m1):
-    m = [m0, m1]
-    for step in range(10):
-        d = dist_from_means(bits, m)
-        closer = np.argmin(d, axis=0)
-        m = []
-        for i in range(2):
-            m.append(np.mean(bits[closer == i], axis=0))
-    return tuple(m)
-
-def read_with_kmeans_on_tile(image, start_row, start_col, limit_row, limit_col):
-    r = image.desc.width * 5 // 4096
-    norm = False
-    bits = []
-    nr = limit_row - start_row
-    nc = limit_col - start_col
-    for i in range(start_row, limit_row):
-        for j in range(start_col, limit_col):
-            bits.append(get_area(image, i, j, r, norm=norm).flatten())
-    bits = np.array(bits)
-    ex1 = get_area(image, 1, 1, r, norm=norm).flatten()
-    ex0 = get_area(image, 2, 1, r, norm=norm).flatten()
-    m = kmeans(bits, ex0, ex1)
-    d = dist_from_means(bits, m)
-
+KMEANS_ITERS = 10
+
+def kmeans_batched(bits, m0, m1, max_iter=KMEANS_ITERS):
+    # Clusters each of the tiles in bits (tiles, n, features) separately,
+    # starting from means m0 and m1. A tile stops as soon as its assignment
+    # doesn't change, which gives the same means as iterating further.
+    # Returns means (tiles, 2, features), the number of iterations and
+    # the final inertia of each tile.
+    bits = np.asarray(bits, dtype=np.float32)
+    t, n, _ = bits.shape
+    m = np.empty((t, 2, bits.shape[-1]), dtype=np.float32)
+    m[:, 0] = m0
+    m[:, 1] = m1
+    sq = np.einsum("tnf,tnf->tn", bits, bits)
+    closer = np.full((t, n), -1)
+    iters = np.zeros(t, dtype=int)
+    for step in range(max_iter):
+        idx = np.flatnonzero(iters == step)
+        if len(idx) == 0:
+            break
+        c = np.argmin(fast_dist_from_means(bits[idx], m[idx], sq[idx]),
+                      axis=1)
+        changed = np.any(c != closer[idx], axis=1)
+        idx = idx[changed]
+        c = c[changed]
+        closer[idx] = c
+        onehot = (c[:, None, :] == np.arange(2)[None, :, None])
+        onehot = onehot.astype(np.float32)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            m[idx] = (np.matmul(onehot, bits[idx])
+                      / np.sum(onehot, axis=-1)[..., None])
+        iters[idx] += 1
+
+    d = fast_dist_from_means(bits, m, sq)
+    inertia = np.sum(np.min(d, axis=1), axis=-1)
+    return m, iters, inertia
+
+def fast_dist_from_means(bits, m, sq=None):
+    # Squared distances (tiles, 2, n) of (tiles, n, features) bits from
+    # the means (tiles, 2, features), computed without a
+    # (tiles, 2, n, features) temporary. sq are the squared norms of bits.
+    if sq is None:
+        sq = np.einsum("tnf,tnf->tn", bits, bits)
+    d = (sq[:, None, :] - 2 * np.matmul(m, bits.transpose(0, 2, 1))
+         + np.sum(np.square(m), axis=-1)[..., None])
+    return np.maximum(d, 0)
+
+def tile_outliers(d, nr, nc):
+    # Positions of the bits furthest from each of the means.
     ind = ([], [])
     for i in range(2):
         v = d[i] < d[1 - i]
@@ -290,79 +438,285 @@ def read_with_kmeans_on_tile(image, start_row, start_col, limit_row, limit_col):
         ind1 = np.unravel_index(np.argsort(d[i]), (nr, nc))
         ind[0].extend(ind1[0][-50:])
         ind[1].extend(ind1[1][-50:])
+    return ind
+
+def tile_bits(image, start_row, start_col, limit_row, limit_col, norm=False):
+    r = patch_radius(image.desc)
+    rows, cols = np.mgrid[start_row:limit_row, start_col:limit_col]
+    return get_areas(image, rows, cols, r, norm=norm).reshape(rows.size, -1)
+
+def example_bits(image, norm=False):
+    # Examples of a one and a zero.
+    r = patch_radius(image.desc)
+    ex1, ex0 = get_areas(image, [1, 2], [1, 1], r, norm=norm).reshape(2, -1)
+    return ex0, ex1
+
+def read_with_kmeans_on_tile(image, start_row, start_col, limit_row, limit_col):
+    norm = False
+    nr = limit_row - start_row
+    nc = limit_col - start_col
+    bits = tile_bits(image, start_row, start_col, limit_row, limit_col, norm)
+    ex0, ex1 = example_bits(image, norm)
+    m, iters, inertia = kmeans_batched(bits[None], ex0, ex1)
+    d = fast_dist_from_means(bits[None].astype(np.float32), m)[0]
+    ind = tile_outliers(d, nr, nc)
 
     #plt.plot(range(d.shape[1]), d[0] - d[1], 'o'); plt.show()
     return np.argmin(d, axis=0).reshape(nr, nc), ind
 
 
-def read_with_kmeans(image):
-    # TODO: check how good this is, maybe try with normalization
-    # gray = scipy.ndimage.gaussian_filter(scipy.ndimage.laplace(np.mean(img, axis=-1)), 2)
-    parts = []
+@dataclass
+class KMeansRead:
+    bits: np.ndarray
+    # Relative distance margin |d0 - d1| / (d0 + d1) of each bit, in [0, 1].
+    confidence: np.ndarray
+    # Per tile, in the order of kmeans_tiles().
+    iterations: np.ndarray
+    inertia: np.ndarray
+    outliers: list
+
+
+def kmeans_tiles():
     n = NROWS // 16
     m = NCOLS // 16
-    for i in range(n):
-        p1 = []
-        for j in range(m):
-            start_row = NROWS * i // n
-            limit_row = NROWS * (i + 1) // n
-            start_col = NCOLS * j // m
-            limit_col = NCOLS * (j + 1) // m
-            v, outl = read_with_kmeans_on_tile(image, start_row, start_col,
-                                               limit_row, limit_col)
-            p1.append(v)
-        parts.append(np.concatenate(p1, axis=1))
-    return np.concatenate(parts, axis=0)
-
-def dump_str(read_bits):
+    return [(NROWS * i // n, NCOLS * j // m,
+             NROWS * (i + 1) // n, NCOLS * (j + 1) // m)
+            for i in range(n) for j in range(m)]
+
+# Image with gray in shared memory, set in each tile worker process.
+worker_image = None
+
+def init_tile_worker(desc, shm_name, shape, dtype, origin):
+    global worker_image
+    shm = shared_memory.SharedMemory(name=shm_name)
+    gray = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    # The shared memory object has to live as long as the array.
+    worker_image = (shm, Image(desc, None, gray, origin))
+
+def tile_bits_in_worker(tile):
+    return tile_bits(worker_image[1], *tile).astype(np.float32)
+
+def read_tiles_bits(image, tiles, workers=None):
+    if workers is None:
+        workers = os.cpu_count()
+    if workers <= 1:
+        return [tile_bits(image, *t).astype(np.float32) for t in tiles]
+
+    gray = image.gray
+    shm = shared_memory.SharedMemory(create=True, size=max(gray.nbytes, 1))
+    try:
+        shared = np.ndarray(gray.shape, dtype=gray.dtype, buffer=shm.buf)
+        shared[...] = gray
+        del shared
+        with ProcessPoolExecutor(
+                min(workers, len(tiles)), initializer=init_tile_worker,
+                initargs=(image.desc, shm.name, gray.shape, gray.dtype.str,
+                          image.origin)) as ex:
+            return list(ex.map(tile_bits_in_worker, tiles))
+    finally:
+        shm.close()
+        shm.unlink()
+
+def tile_result(d, iters, inertia, nr, nc):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        conf = np.abs(d[0] - d[1]) / (d[0] + d[1])
+    return {
+        "labels": np.argmin(d, axis=0).reshape(nr, nc),
+        "confidence": np.nan_to_num(conf).reshape(nr, nc),
+        "iterations": np.array(iters),
+        "inertia": np.array(inertia),
+        "outliers": np.array(tile_outliers(d, nr, nc)),
+    }
+
+def image_digest(image):
+    if image.digest is None:
+        h = hashlib.sha1(np.ascontiguousarray(image.gray))
+        h.update(repr((image.gray.shape, image.gray.dtype.str,
+                       image.origin)).encode())
+        image.digest = h.hexdigest()
+    return image.digest
+
+def tile_cache_key(image, tile):
+    sr, sc, lr, lc = tile
+    lattice = bit_lattice(image.desc)
+    h = hashlib.sha1(image_digest(image).encode())
+    h.update(repr((tile, patch_radius(image.desc), KMEANS_ITERS)).encode())
+    h.update(lattice[sr:lr, sc:lc].tobytes())
+    # The examples initialize the means of every tile.
+    h.update(lattice[[1, 2], [1, 1]].tobytes())
+    return h.hexdigest()
+
+class TileCache:
+    # Results of read tiles, stored in files named after their key. Files
+    # are touched when read, and the least recently used ones are removed
+    # when there are more than max_entries.
+    def __init__(self, cache_dir, max_entries=4096):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path) as f:
+                res = dict(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return res
+
+    def put(self, key, res):
+        path = self.path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **res)
+        os.replace(tmp, path)
+
+    def evict(self):
+        entries = []
+        for e in os.scandir(self.cache_dir):
+            if e.name.endswith(".npz"):
+                entries.append((e.stat().st_mtime_ns, e.path))
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            os.remove(path)
+
+def classify_with_kmeans(image, workers=None, cache_dir=None):
+    # TODO: check how good this is, maybe try with normalization
+    # gray = scipy.ndimage.gaussian_filter(scipy.ndimage.laplace(np.mean(img, axis=-1)), 2)
+    # The tiles are sampled in a pool of worker processes, or serially with
+    # workers=1, and then all clustered at once. With cache_dir only tiles
+    # whose inputs changed since the last run are read again.
+    tiles = kmeans_tiles()
+    results = [None] * len(tiles)
+    if cache_dir is not None:
+        cache = TileCache(cache_dir)
+        keys = [tile_cache_key(image, t) for t in tiles]
+        results = [cache.get(k) for k in keys]
+    todo = [t for t, r in enumerate(results) if r is None]
+    if todo:
+        bits = np.stack(read_tiles_bits(image, [tiles[t] for t in todo],
+                                        workers))
+        done = cluster_tiles(image, [tiles[t] for t in todo], bits)
+        for t, r in zip(todo, done):
+            results[t] = r
+            if cache_dir is not None:
+                cache.put(keys[t], r)
+        if cache_dir is not None:
+            cache.evict()
+    return kmeans_read(tiles, results)
+
+def cluster_tiles(image, tiles, bits):
+    # Results of the tiles from their stacked bits, all clustered at once.
+    ex0, ex1 = example_bits(image)
+    m, iters, inertia = kmeans_batched(bits, ex0, ex1)
+    d = fast_dist_from_means(bits, m)
+    return [tile_result(d[k], iters[k], inertia[k], lr - sr, lc - sc)
+            for k, (sr, sc, lr, lc) in enumerate(tiles)]
+
+def kmeans_read(tiles, results):
+    res = np.zeros((NROWS, NCOLS), dtype=int)
+    confidence = np.zeros((NROWS, NCOLS), dtype=np.float32)
+    for (sr, sc, lr, lc), r in zip(tiles, results):
+        res[sr:lr, sc:lc] = r["labels"]
+        confidence[sr:lr, sc:lc] = r["confidence"]
+    shape = (NROWS // 16, NCOLS // 16)
+    return KMeansRead(
+        res, confidence,
+        np.array([r["iterations"] for r in results]).reshape(shape),
+        np.array([r["inertia"] for r in results]).reshape(shape),
+        [r["outliers"] for r in results])
+
+def read_with_kmeans(image, workers=None, cache_dir=None):
+    return classify_with_kmeans(image, workers, cache_dir).bits
+
+def load_images(descs, **kwargs):
+    with ThreadPoolExecutor(len(descs)) as ex:
+        return list(ex.map(lambda d: load_image(d, **kwargs), descs))
+
+def dump_rows(read_bits):
+    # The fifth row of every group of five is not part of the dump.
     rows = []
     for i in range(16):
         for j in range(4):
-            rows.append("".join([str(b) for b in read_bits[i * 5 + j]]))
-    return "\n".join(rows)
-
-def show_bits(image, bits, v):
-    plt.imshow(image.img)
-    points = []
-    for i in range(NROWS):
-        for j in range(NCOLS):
-            if bits[i, j] == v:
-                points.append(bit_pos(image.desc, i, j))
-    plt.plot([p[0] for p in points], [p[1] for p in points], 'o', alpha=0.3)
+            rows.append(read_bits[i * 5 + j])
+    return np.array(rows)
+
+def dump_str(read_bits):
+    return "\n".join("".join([str(b) for b in row])
+                     for row in dump_rows(read_bits))
+
+def rgb8(img):
+    if img.ndim == 2:
+        img = np.stack([img] * 3, axis=-1)
+    img = img[..., :3]
+    if img.dtype != np.uint8:
+        img = (img * (255 / max(np.max(img), 1))).astype(np.uint8)
+    return img
+
+def show_downsampled(image, max_size=2048):
+    # Shows the image scaled down to at most max_size pixels on each side,
+    # in the coordinates of the full image.
+    img = image.rgb()
+    s = max(1, -(-max(img.shape[:2]) // max_size))
+    plt.imshow(rgb8(img[::s, ::s]),
+               extent=(0, img.shape[1], img.shape[0], 0))
+
+def show_bits(image, bits, v, max_size=2048):
+    show_downsampled(image, max_size)
+    points = bit_lattice(image.desc)[bits == v]
+    plt.plot(points[:, 0], points[:, 1], 'o', alpha=0.3, markersize=2)
     plt.show()
 
-def show_outliers(image, bits, outliers, v):
-    plt.imshow(image.img)
-    points = []
-    for i, j in zip(*outliers):
-        if bits[i, j] == v:
-            points.append(bit_pos(image.desc, i, j))
-    plt.plot([p[0] for p in points], [p[1] for p in points], 'o', alpha=0.3)
+def show_outliers(image, bits, outliers, v, max_size=2048):
+    show_downsampled(image, max_size)
+    rows, cols = np.asarray(outliers[0]), np.asarray(outliers[1])
+    sel = bits[rows, cols] == v
+    points = bit_lattice(image.desc)[rows[sel], cols[sel]]
+    plt.plot(points[:, 0], points[:, 1], 'o', alpha=0.3)
     plt.show()
 
-def combine_fx_images():
-    img1 = load_image(FX2500_ROM)
-    bits1 = read_with_kmeans(img1)
-    img2 = load_image(FX2500_ROM_2)
-    bits2 = read_with_kmeans(img2)
+def combine_fx_images(workers=None):
+    img1, img2 = load_images([FX2500_ROM, FX2500_ROM_2])
+    bits1 = read_with_kmeans(img1, workers)
+    bits2 = read_with_kmeans(img2, workers)
     return np.concatenate((bits2[0:16], bits1[16:]), axis=0)
 
-def combine_gh_images():
-    img1 = load_image(FX2500_GH)
-    bits1 = read_with_kmeans(img1)
-    img2 = load_image(MK51_GH)
-    bits2 = read_with_kmeans(img2)
+def combine_gh_images(workers=None):
+    img1, img2 = load_images([FX2500_GH, MK51_GH])
+    bits1 = read_with_kmeans(img1, workers)
+    bits2 = read_with_kmeans(img2, workers)
     bits = bits1.copy()
     s1 = slice(43, 80)
     s2 = slice(126, 149)
     bits[s1, s2] = bits2[s1, s2]
     return bits
 
+def fuse_reads(reads):
+    # Confidence-weighted vote of the reads of each bit. Returns the bits
+    # and a mask of the bits on which the reads disagree, which can be
+    # passed to print_fix_template. Ties go to the first read.
+    votes = sum(r.confidence * (2 * r.bits - 1) for r in reads)
+    bits = np.where(votes == 0, reads[0].bits, votes > 0).astype(int)
+    disagree = np.zeros((NROWS, NCOLS), dtype=bool)
+    for r in reads[1:]:
+        disagree |= r.bits != reads[0].bits
+    return bits, disagree
+
+def fuse_images(descs, workers=None, **kwargs):
+    images = load_images(descs, **kwargs)
+    return fuse_reads([classify_with_kmeans(img, workers) for img in images])
+
+def count_fixes(bits):
+    return sum(1 for p, v in FIXES.items() if bits[p] != v)
+
 def apply_fixes(bits):
     res = bits.copy()
-    n = 0
+    n = count_fixes(bits)
     for p, v in FIXES.items():
-        if res[p] != v: n += 1
         res[p] = v
     print(f"Fixed {n} bits")
     return res
@@ -376,13 +730,86 @@ def show_selected_bit_versions(mask, *images):
         print(p)
         fig, axes = plt.subplots(nrows=1, ncols=len(images))
         for ax, img in zip(axes, images):
-            bp = bit_pos(img.desc, p[0], p[1])
+            bp = bit_lattice(img.desc)[p[0], p[1]]
             ibp = (int(bp[0]), int(bp[1]))
-            ax.imshow(img.img[ibp[1] - 10:ibp[1] + 10,
+            ax.imshow(img.rgb()[ibp[1] - 10:ibp[1] + 10,
                               ibp[0] - 10:ibp[0] + 10])
         plt.show()
 
+def bit_crops(image, positions, size=20):
+    # (n, size, size, 3) crops of the RGB image around the given bits,
+    # black outside the image.
+    img = rgb8(image.rgb())
+    c = np.round(bit_lattice(image.desc)[positions[:, 0],
+                                         positions[:, 1]]).astype(int)
+    off = np.arange(size) - size // 2
+    ys = c[:, 1, None] + off
+    xs = c[:, 0, None] + off
+    inside = (((ys >= 0) & (ys < img.shape[0]))[:, :, None]
+              & ((xs >= 0) & (xs < img.shape[1]))[:, None, :])
+    crops = img[np.clip(ys, 0, img.shape[0] - 1)[:, :, None],
+                np.clip(xs, 0, img.shape[1] - 1)[:, None, :]]
+    crops[~inside] = 0
+    return crops
+
+def contact_sheet(mask, images, size=20, per_column=50, label_width=80):
+    # One array with the crops of all bits in mask. Each bit is a row of
+    # crops, one per image, after label_width pixels of space for a label.
+    # Rows are wrapped into columns of per_column bits. Returns the sheet
+    # and the positions of the bits.
+    positions = np.argwhere(mask)
+    n = len(positions)
+    if not n:
+        # No suspect bits, for example when all fused reads agree.
+        return np.full((0, label_width, 3), 255, dtype=np.uint8), positions
+    ncols = max(1, -(-n // per_column))
+    nrows = min(n, per_column)
+    cell_w = label_width + len(images) * size
+    sheet = np.full((nrows * size, ncols * cell_w, 3), 255, dtype=np.uint8)
+    k = np.arange(n)
+    r0 = (k % per_column) * size
+    c0 = (k // per_column) * cell_w + label_width
+    yy, xx = np.mgrid[0:size, 0:size]
+    for t, img in enumerate(images):
+        crops = bit_crops(img, positions, size)
+        sheet[r0[:, None, None] + yy, c0[:, None, None] + t * size + xx] = (
+            crops)
+    return sheet, positions
+
+def show_contact_sheet(mask, *images, bits=None, path=None, size=20,
+                       per_column=50):
+    # Shows or, if path is given, saves all crops of the bits in mask as
+    # one image, labelled with the positions and the values from bits.
+    label_width = 80
+    sheet, positions = contact_sheet(mask, images, size, per_column,
+                                     label_width)
+    if not len(positions):
+        print("No bits to show")
+        return
+    cell_w = label_width + len(images) * size
+    dpi = 100
+    fig = plt.figure(figsize=(sheet.shape[1] / dpi, sheet.shape[0] / dpi),
+                     dpi=dpi)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.imshow(sheet, interpolation="nearest")
+    ax.set_axis_off()
+    for k, (i, j) in enumerate(positions):
+        label = f"({i}, {j})"
+        if bits is not None:
+            label += f": {bits[i, j]}"
+        ax.text((k // per_column) * cell_w + 2,
+                (k % per_column) * size + size / 2, label,
+                va="center", fontsize=size * 0.3)
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path, dpi=dpi)
+        plt.close(fig)
+
 if __name__ == "__main__":
-    b = apply_fixes(combine_gh_images())
+    b0 = combine_gh_images()
+    b = apply_fixes(b0)
     with open("mk51fx2500rom.txt", "w") as f:
         f.write(dump_str(b))
+    rom_format.write_rom_bin(rom_format.BIN_PATH, dump_rows(b),
+                             [FX2500_GH.path, MK51_GH.path], count_fixes(b0))
@@ -0,0 +1,202 @@
+# Packed register file: the 8 registers of 15 4-bit digits are stored in
+# a 60-byte bytearray, two digits per byte, instead of nested lists.
+# Copying, hashing and comparing a register file then works on bytes.
+#
+# It keeps the interface of the nested lists used by the emulator and the
+# analysis code: regs[r] is a view of register r, indexed and sliced like
+# a list, regs[r][i] = v sets a digit, and regs[r] = values sets a whole
+# register. Like with lists, regs[a] = regs[b] makes a and b the same
+# register. To support that, registers are mapped to slots of the storage.
+# Setting a register to new values writes them to its slot only if no
+# other register and no view uses it. Otherwise the register moves to a
+# free slot, as a list would be replaced, so the other registers and the
+# views taken before keep the old values. The storage grows by a slot if
+# none is free, and copy() packs it back to 8 slots.
+
+import numpy as np
+
+REGS = 8
+DIGITS = 15
+
+def check_digit(v):
+    if not 0 <= v < 16:
+        raise ValueError(f"digit out of range: {v}")
+    return v
+
+class Register:
+    def __init__(self, file, slot):
+        self.file = file
+        self.slot = slot
+        file.views[slot] += 1
+
+    def __del__(self):
+        self.file.views[self.slot] -= 1
+
+    def __len__(self):
+        return DIGITS
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(DIGITS))]
+        if i < 0:
+            i += DIGITS
+        if not 0 <= i < DIGITS:
+            raise IndexError("register index out of range")
+        k = self.slot * DIGITS + i
+        return self.file.data[k >> 1] >> (k & 1) * 4 & 15
+
+    def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            indices = range(*i.indices(DIGITS))
+            v = list(v)
+            if len(v) != len(indices):
+                raise ValueError("registers can't be resized")
+            for k, d in zip(indices, v):
+                self[k] = d
+            return
+        if i < 0:
+            i += DIGITS
+        if not 0 <= i < DIGITS:
+            raise IndexError("register index out of range")
+        k = self.slot * DIGITS + i
+        shift = (k & 1) * 4
+        data = self.file.data
+        data[k >> 1] = data[k >> 1] & ~(15 << shift) | check_digit(v) << shift
+
+    def __iter__(self):
+        return (self[i] for i in range(DIGITS))
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def copy(self):
+        return list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+class RegisterFile:
+    def __init__(self, regs=None):
+        # regs: initial values, such as the nested lists of the emulator.
+        self.data = bytearray(REGS * DIGITS // 2)
+        self.slots = list(range(REGS))
+        # Number of live Register views of each slot of the storage.
+        self.views = [0] * REGS
+        if regs is not None:
+            for r, v in enumerate(regs):
+                self[r] = v
+
+    def __len__(self):
+        return REGS
+
+    def __getitem__(self, r):
+        if isinstance(r, slice):
+            return [self[k] for k in range(*r.indices(REGS))]
+        return Register(self, self.slots[r])
+
+    def __setitem__(self, r, v):
+        if isinstance(v, Register) and v.file is self:
+            self.slots[r] = v.slot
+            return
+        v = list(v)
+        if len(v) != DIGITS:
+            raise ValueError("registers can't be resized")
+        slot = self.slots[r]
+        if self.views[slot] or self.slots.count(slot) > 1:
+            self.slots[r] = self.free_slot()
+        Register(self, self.slots[r])[:] = v
+
+    def free_slot(self):
+        for slot, n in enumerate(self.views):
+            if not n and slot not in self.slots:
+                return slot
+        self.views.append(0)
+        self.data.extend(bytes((len(self.views) * DIGITS + 1) // 2
+                               - len(self.data)))
+        return len(self.views) - 1
+
+    def __iter__(self):
+        return (self[r] for r in range(REGS))
+
+    def packed(self):
+        # The digits of the registers in order, two per byte.
+        if self.slots == list(range(REGS)):
+            return bytes(self.data[:REGS * DIGITS // 2])
+        res = RegisterFile(self)
+        return bytes(res.data)
+
+    def copy(self):
+        res = RegisterFile.__new__(RegisterFile)
+        res.views = [0] * REGS
+        if len(self.views) == REGS:
+            res.data = bytearray(self.data)
+            res.slots = list(self.slots)
+            return res
+        res.data = bytearray(REGS * DIGITS // 2)
+        res.slots = []
+        # New slot of each slot used by the registers, so that registers
+        # sharing a slot still do.
+        moved = {}
+        for slot in self.slots:
+            if slot not in moved:
+                moved[slot] = len(moved)
+                Register(res, moved[slot])[:] = Register(self, slot)
+            res.slots.append(moved[slot])
+        return res
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __getstate__(self):
+        # Without the views, which aren't pickled.
+        res = self.copy()
+        return {"data": res.data, "slots": res.slots}
+
+    def __setstate__(self, state):
+        self.data = state["data"]
+        self.slots = state["slots"]
+        self.views = [0] * REGS
+
+    def __eq__(self, other):
+        if isinstance(other, RegisterFile):
+            return self.packed() == other.packed()
+        try:
+            return [list(r) for r in self] == [list(r) for r in other]
+        except TypeError:
+            return NotImplemented
+
+    def __hash__(self):
+        # Of the current contents; don't change a register file used as a
+        # key.
+        return hash(self.packed())
+
+    def diff(self, other):
+        # (r, i, self digit, other digit) where the digits differ.
+        a = self.packed()
+        b = other.packed() if isinstance(other, RegisterFile) else \
+            RegisterFile(other).packed()
+        res = []
+        if a == b:
+            return res
+        for n, (x, y) in enumerate(zip(a, b)):
+            if x != y:
+                for k in (2 * n, 2 * n + 1):
+                    shift = (k & 1) * 4
+                    if x >> shift & 15 != y >> shift & 15:
+                        res.append((k // DIGITS, k % DIGITS,
+                                    x >> shift & 15, y >> shift & 15))
+        return res
+
+    def array(self):
+        # (8, 15) uint8 array of the digits.
+        data = np.frombuffer(self.packed(), dtype=np.uint8)
+        res = np.empty(REGS * DIGITS, dtype=np.uint8)
+        res[0::2] = data & 15
+        res[1::2] = data >> 4
+        return res.reshape(REGS, DIGITS)
+
+    def __repr__(self):
+        return f"RegisterFile({[list(r) for r in self]})"
@@ -0,0 +1,63 @@
+# Bit-packed binary form of the ROM dump.
+#
+# The file starts with a header:
+#   magic     8 bytes, b"MK51ROM\0"
+#   version   uint16
+#   nrows     uint16, number of rows of bits (lines of the text dump)
+#   ncols     uint16, number of bits in a row
+#   nfixes    uint16, number of bits changed by read_rom.apply_fixes
+#   nsources  uint32, length of the JSON list of source image paths
+#   sources   nsources bytes
+# followed by the rows of bits packed with np.packbits, each row padded to
+# whole bytes. All numbers are little endian.
+
+import json
+import numpy as np
+import struct
+
+MAGIC = b"MK51ROM\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHHHHI")
+BIN_PATH = "mk51fx2500rom.bin"
+TEXT_PATH = "mk51fx2500rom.txt"
+
+def write_rom_bin(path, rows, sources=(), nfixes=0):
+    rows = np.asarray(rows, dtype=np.uint8)
+    src = json.dumps(list(sources)).encode()
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, rows.shape[0], rows.shape[1],
+                            nfixes, len(src)))
+        f.write(src)
+        f.write(np.packbits(rows, axis=1).tobytes())
+
+def convert_text(text_path=TEXT_PATH, path=BIN_PATH):
+    # Writes the packed file for an existing text dump.
+    with open(text_path) as f:
+        rows = [[int(c) for c in line.strip()] for line in f if line.strip()]
+    write_rom_bin(path, rows, sources=[text_path])
+
+class PackedRom:
+    def __init__(self, path=BIN_PATH):
+        with open(path, "rb") as f:
+            head = f.read(HEADER.size)
+            magic, version, self.nrows, self.ncols, self.nfixes, nsrc = (
+                HEADER.unpack(head))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a packed ROM file")
+            self.sources = json.loads(f.read(nsrc))
+        self.packed = np.memmap(path, dtype=np.uint8, mode="r",
+                                offset=HEADER.size + nsrc,
+                                shape=(self.nrows, (self.ncols + 7) // 8))
+
+    def bit(self, row, col):
+        return (self.packed[row, col >> 3] >> (7 - (col & 7))) & 1
+
+    def rows(self):
+        return np.unpackbits(self.packed, axis=1, count=self.ncols)
+
+    def lines(self):
+        # Same lines as in the text dump.
+        return ["".join("01"[b] for b in row) for row in self.rows()]
+
+if __name__ == "__main__":
+    convert_text()
@@ -0,0 +1,109 @@
+# Profiling of the code executed by the emulator.
+#
+# A Profiler is added to Emulator.hooks. It counts how many times each
+# address is executed and, by following the depth of the emulator's return
+# stack (len(e.stack)), how many calls of each routine were made, and how
+# many steps were spent in them, with the routines they called (inclusive)
+# and without them (exclusive). Routines are identified by the address
+# they were called at.
+
+from array import array
+
+from annotations import Annotations
+
+ROM_SIZE = 0x400
+
+class Profiler:
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * ROM_SIZE))
+        self.calls = {}
+        self.inclusive = {}
+        self.exclusive = {}
+        self.frames = []
+        self.depth = 0
+        self.last_pc = None
+        self.last_steps = None
+        # Steps skipped by Emulator.run(), which are in the inclusive and
+        # exclusive totals but not in counts.
+        self.skipped = 0
+
+    def attach(self, e):
+        self.last_pc = e.pc
+        self.last_steps = e.steps
+        self.depth = len(e.stack)
+        # The frame of the code running when the profiler was attached.
+        self.frames = [(None, e.steps)]
+        e.hooks.append(self)
+        return self
+
+    def detach(self, e):
+        e.hooks.remove(self)
+        # Steps skipped by Emulator.run() since the last step.
+        top = self.frames[-1][0]
+        self.exclusive[top] = (self.exclusive.get(top, 0)
+                               + e.steps - self.last_steps)
+        self.skipped += e.steps - self.last_steps
+        while self.frames:
+            self.ret(e.steps)
+
+    def ret(self, steps):
+        entry, start = self.frames.pop()
+        self.inclusive[entry] = self.inclusive.get(entry, 0) + steps - start
+
+    def __call__(self, e):
+        self.counts[self.last_pc] += 1
+        self.skipped += e.steps - self.last_steps - 1
+        # Steps skipped by Emulator.run() count for the current routine.
+        top = self.frames[-1][0]
+        self.exclusive[top] = (self.exclusive.get(top, 0)
+                               + e.steps - self.last_steps)
+        depth = len(e.stack)
+        if depth > self.depth:
+            self.calls[e.pc] = self.calls.get(e.pc, 0) + 1
+            self.frames.append((e.pc, e.steps))
+        else:
+            for i in range(self.depth - depth):
+                if len(self.frames) > 1:
+                    self.ret(e.steps)
+        self.depth = depth
+        self.last_pc = e.pc
+        self.last_steps = e.steps
+
+    def coverage(self):
+        # Bitmap of the executed addresses, bit k of byte k // 8 for
+        # address k.
+        bitmap = bytearray(ROM_SIZE // 8)
+        for addr, n in enumerate(self.counts):
+            if n:
+                bitmap[addr >> 3] |= 1 << (addr & 7)
+        return bytes(bitmap)
+
+    def report(self, annotations=None, top=20):
+        if annotations is None:
+            annotations = Annotations()
+        lines = []
+        executed = sum(self.counts)
+        covered = sum(1 for n in self.counts if n)
+        lines.append(f"{executed + self.skipped} steps, {covered} of "
+                     f"{ROM_SIZE} addresses executed")
+        if self.skipped:
+            lines.append(f"{self.skipped} idle steps skipped by "
+                         "Emulator.run() are not counted by address")
+        lines.append("")
+        lines.append(f"{'routine':24s} {'calls':>8s} {'inclusive':>10s} "
+                     f"{'exclusive':>10s}")
+        routines = sorted(self.exclusive,
+                          key=lambda r: -self.exclusive[r])[:top]
+        for r in routines:
+            lines.append(f"{annotations.name(r):24s} "
+                         f"{self.calls.get(r, 0):8d} "
+                         f"{self.inclusive.get(r, 0):10d} "
+                         f"{self.exclusive[r]:10d}")
+        lines.append("")
+        lines.append(f"{'address':40s} {'count':>10s}")
+        hot = sorted(range(ROM_SIZE), key=lambda a: -self.counts[a])[:top]
+        for addr in hot:
+            if self.counts[addr]:
+                lines.append(f"{annotations.describe(addr):40s} "
+                             f"{self.counts[addr]:10d}")
+        return "\n".join(lines)
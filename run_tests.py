@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+
+# Runs the ROM behaviour test suites in parallel. The tests are split into
+# shards run by a pool of worker processes. Each worker parses the program
+# and boots the emulator once, when it starts, so the tests only fork warm
+# state.
+
+import argparse
+import io
+import os
+import sys
+import time
+import unittest
+
+from concurrent.futures import ProcessPoolExecutor
+
+import emutools
+
+SUITES = ["test_code", "test_emutools", "test_explore_states",
+          "test_rom_format", "test_rom_profile", "test_xref"]
+
+def test_ids(suite):
+    if isinstance(suite, unittest.TestCase):
+        return [suite.id()]
+    return [i for test in suite for i in test_ids(test)]
+
+def init_worker():
+    emutools.program()
+    emutools.at_keyscan()
+
+def run_shard(ids):
+    suite = unittest.defaultTestLoader.loadTestsFromNames(ids)
+    out = io.StringIO()
+    result = unittest.TextTestRunner(stream=out, verbosity=0).run(suite)
+    problems = [(test.id(), trace)
+                for test, trace in result.failures + result.errors]
+    return result.testsRun, problems, out.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("suites", nargs="*", default=SUITES)
+    args = parser.parse_args()
+
+    ids = test_ids(unittest.defaultTestLoader.loadTestsFromNames(args.suites))
+    workers = max(1, min(args.workers, len(ids)))
+    # Round robin, so the slow tests of one class don't end up in one shard.
+    shards = [ids[k::workers] for k in range(workers)]
+    start = time.time()
+    run = 0
+    problems = []
+    with ProcessPoolExecutor(workers, initializer=init_worker) as ex:
+        for n, p, out in ex.map(run_shard, shards):
+            run += n
+            problems += p
+    for test, trace in problems:
+        print("=" * 70)
+        print(test)
+        print("-" * 70)
+        print(trace)
+    print(f"Ran {run} tests in {time.time() - start:.3f}s on {workers} "
+          "workers")
+    print(f"FAILED ({len(problems)} problems)" if problems else "OK")
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,15 +7,15 @@ RE_REPOSITORY = "mk51fx2500re"
 if RE_REPOSITORY not in sys.path:
     sys.path.insert(0, RE_REPOSITORY)
 
-import emulator
+import emutools
 from calculator import *
 from keys import *
-from program import Program
 from bits import bit
 
 class TestCode(unittest.TestCase):
     def setUp(self):
-        self.emulator = emulator.Emulator(Program.from_file())
+        # A fork of the calculator booted once and waiting for a key.
+        self.emulator = emutools.at_keyscan()
 
     def press(self, keys):
         execute_seq(self.emulator, keys, print_disp=False)
@@ -0,0 +1,332 @@
+#!/usr/bin/python3
+
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+
+
+import arith_harness
+import display
+import emutools
+import hle
+import tracing
+from registers import RegisterFile
+from calculator import *
+from keys import *
+
+class TestEmuTools(unittest.TestCase):
+    def test_fork_is_independent(self):
+        e = emutools.create_emulator()
+        f = e.fork()
+        f.regs[0][0] = 5
+        f.call(0x0d4)
+        self.assertEqual(e.regs[0][0], 0)
+        self.assertEqual(decode_num(f.regs[0]), Decimal("3.14159265"))
+
+    def test_fork_shares_program(self):
+        e = emutools.create_emulator()
+        f = e.fork()
+        for name, v in vars(e).items():
+            if isinstance(v, emutools.Program):
+                self.assertIs(getattr(f, name), v)
+
+    def test_program_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            saved = dict(emutools.programs)
+            try:
+                emutools.programs.clear()
+                emutools.program(tmp)
+                self.assertEqual(len(os.listdir(tmp)), 1)
+                emutools.programs.clear()
+                e = emutools.Emulator(emutools.program(tmp))
+            finally:
+                emutools.programs.clear()
+                emutools.programs.update(saved)
+        e.call(0x0d4)
+        self.assertEqual(decode_num(e.regs[0]), Decimal("3.14159265"))
+
+    def test_at_keyscan_matches_cold_boot(self):
+        e = emutools.create_emulator()
+        execute_seq(e, [KINV, KMODE], print_disp=False)
+        e.keycode = 0
+        e.until(emutools.KEYSCAN)
+        f = emutools.at_keyscan([KINV, KMODE])
+        self.assertEqual(f.regs, e.regs)
+        self.assertEqual(f.pc, e.pc)
+
+    def test_at_keyscan_returns_fresh_copies(self):
+        e = emutools.at_keyscan()
+        execute_seq(e, [K4], print_disp=False)
+        f = emutools.at_keyscan()
+        self.assertNotEqual(f.regs, e.regs)
+
+    def test_run_skips_idle_cycles_exactly(self):
+        e = emutools.at_keyscan()
+        f = e.fork()
+        self.assertEqual(e.run(max_steps=e.steps + 100000), "limit")
+        for i in range(100000):
+            f.step()
+        self.assertEqual(e.steps, f.steps)
+        self.assertEqual(emutools.state_diff(e, f), {})
+
+    def test_run_reports_idle(self):
+        e = emutools.at_keyscan()
+        self.assertEqual(e.run(until=[0x381]), "idle")
+
+    def test_until_returns_when_idle(self):
+        e = emutools.at_keyscan()
+        self.assertEqual(e.until(0x381), "idle")
+        self.assertEqual(e.pc, emutools.KEYSCAN)
+
+    def test_run_applies_events(self):
+        e = emutools.at_keyscan()
+        f = e.fork()
+        start = e.steps
+        e.run(max_steps=start + 50000, events=[(start + 20000, KMODE)])
+        for i in range(20000):
+            f.step()
+        f.keycode = KMODE
+        for i in range(30000):
+            f.step()
+        self.assertEqual(emutools.state_diff(e, f), {})
+
+    def test_trace_file_round_trip(self):
+        e = emutools.at_keyscan()
+        e.keycode = KMODE
+        f = e.fork()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "key.trc")
+            trace = tracing.Trace(capacity=64, regs=True, path=path)
+            trace.attach(e)
+            for i in range(1000):
+                e.step()
+            trace.close()
+            pcs = []
+            for i in range(1000):
+                f.step()
+                pcs.append(f.pc)
+            tf = tracing.TraceFile(path)
+            steps, values = tf.pcs()
+            self.assertEqual(values.tolist(), pcs)
+            self.assertEqual(tf.pcs(steps[10], steps[19])[1].tolist(),
+                             pcs[10:20])
+            tf.close()
+
+    def test_trace_file_reg_changes(self):
+        # Many digits change in a step, more than a buffer holds.
+        e = emutools.at_keyscan()
+        e.keycode = KMODE
+        f = e.fork()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "key.trc")
+            trace = tracing.Trace(capacity=8, regs=True, path=path)
+            trace.attach(e)
+            for i in range(2000):
+                e.step()
+            trace.close()
+            changes = []
+            prev = [list(r) for r in f.regs]
+            for i in range(2000):
+                f.step()
+                regs = [list(r) for r in f.regs]
+                changes += [(f.steps, r, d, regs[r][d])
+                            for r in range(8) for d in range(15)
+                            if regs[r][d] != prev[r][d]]
+                prev = regs
+            tf = tracing.TraceFile(path)
+            steps, rs, ds, vs = tf.reg_changes()
+            self.assertEqual(list(zip(steps, rs, ds, vs)), changes)
+            tf.close()
+
+    def test_hle_matches_rom(self):
+        handlers = hle.Hle().handlers
+        self.assertIn(0x0d4, handlers)
+        for addr in handlers:
+            e = emutools.create_emulator()
+            set_num(e, 0, Decimal("123.45"))
+            set_num(e, 1, Decimal("2.1"))
+            f = e.fork()
+            e.hle = hle.Hle()
+            e.call(addr)
+            f.call(addr)
+            self.assertEqual(e.hle.calls, {addr: 1})
+            self.assertEqual(e.steps, f.steps)
+            self.assertEqual(emutools.state_diff(e, f), {}, hex(addr))
+
+    def test_hle_shadow_has_no_divergences(self):
+        # The operands of test_code.py, in a state other than the ones the
+        # effects are captured in.
+        for addr in hle.Hle().handlers:
+            e = emutools.at_keyscan([K8, KPLUS])
+            set_num(e, 0, Decimal("123.45"))
+            set_num(e, 1, Decimal("23.4"))
+            f = e.fork()
+            e.hle = hle.Hle(shadow=True)
+            e.call(addr)
+            f.call(addr)
+            self.assertEqual(e.hle.calls, {addr: 1})
+            self.assertEqual(e.hle.divergences, [])
+            self.assertEqual(e.steps, f.steps)
+            self.assertEqual(emutools.state_diff(e, f), {})
+
+    def test_hle_shadow_reports_state_diff(self):
+        e = emutools.create_emulator()
+        e.hle = hle.Hle(names=["pi_to_r0"], shadow=True)
+        e.hle.handlers[0x0d4] = hle.Effect({(0, 12): 2}, {}, 1)
+        e.call(0x0d4)
+        [d] = e.hle.divergences
+        self.assertEqual(d.addr, 0x0d4)
+        self.assertIn("regs", d.diff)
+        self.assertEqual(d.diff["steps"][0], 1)
+        self.assertEqual(decode_num(e.regs[0]), Decimal("3.14159265"))
+
+    def test_hle_only_handles_calls(self):
+        # subr01 runs into the entry of addr01 without a call, which must
+        # not be handled.
+        e = emutools.create_emulator()
+        set_num(e, 0, Decimal("123.45"))
+        set_num(e, 1, Decimal("2.1"))
+        f = e.fork()
+        e.hle = hle.Hle(names=[])
+        e.hle.handlers[0x082] = hle.Effect({}, {}, 1)
+        e.call(0x081)
+        f.call(0x081)
+        self.assertEqual(e.hle.calls, {})
+        self.assertEqual(emutools.state_diff(e, f), {})
+
+    def test_display_events_only_on_change(self):
+        e = emutools.at_keyscan()
+        watcher = display.DisplayWatcher().attach(e)
+        execute_seq(e, [K4, K5], print_disp=False)
+        watcher.detach(e)
+        self.assertEqual(watcher.events[-1].text, display.display_text(e))
+        for a, b in zip(watcher.events, watcher.events[1:]):
+            self.assertNotEqual(a.text, b.text)
+
+    def test_display_digest_ignores_hidden_bits(self):
+        e = emutools.create_emulator()
+        f = e.fork()
+        e.regs[0][12] = 10
+        e.regs[1][12] = 8
+        f.regs[0][12] = 15
+        f.regs[1][12] = 9
+        self.assertEqual(display.display_digest(e), display.display_digest(f))
+        f.regs[1][12] = 12
+        self.assertNotEqual(display.display_digest(e),
+                            display.display_digest(f))
+
+    def test_display_events_generator(self):
+        e = emutools.at_keyscan()
+        events = display.key_events([K4], e.steps, gap=50000)
+        frames = list(display.display_events(e, max_steps=e.steps + 100000,
+                                             events=events))
+        f = emutools.at_keyscan()
+        execute_seq(f, [K4], print_disp=False)
+        self.assertEqual(frames[-1].text, display.display_text(f))
+
+    def test_register_file_list_semantics(self):
+        lists = [[(r + i) % 16 for i in range(15)] for r in range(8)]
+        regs = RegisterFile(lists)
+        self.assertEqual(regs, lists)
+        regs[0], regs[1] = regs[1], regs[0]
+        lists[0], lists[1] = lists[1], lists[0]
+        self.assertEqual(regs, lists)
+        regs[2] = regs[3]
+        regs[2][0] = 9
+        self.assertEqual(regs[3][0], 9)
+        regs[4][2:5] = [7, 7, 7]
+        regs[3] = [1] * 15
+        self.assertEqual(regs[2][0], 9)
+        lists[2] = lists[3]
+        lists[2][0] = 9
+        lists[4][2:5] = [7, 7, 7]
+        lists[3] = [1] * 15
+        self.assertEqual(regs, lists)
+
+    def test_register_file_keeps_old_views(self):
+        lists = [[(r + i) % 16 for i in range(15)] for r in range(8)]
+        regs = RegisterFile(lists)
+        old = [regs[r] for r in range(8)]
+        for r in range(8):
+            regs[r] = [r] * 15
+        self.assertEqual(old, lists)
+        old[0][0] = 5
+        self.assertEqual(regs[0][0], 0)
+        self.assertEqual(regs, [[r] * 15 for r in range(8)])
+        copy = regs.copy()
+        self.assertEqual(len(copy.data), len(RegisterFile().data))
+        self.assertEqual(copy, regs)
+        regs[1] = regs[2]
+        regs[2][0] = 9
+        self.assertEqual(regs.copy()[1][0], 9)
+
+    def test_register_file_copy_hash_diff(self):
+        regs = RegisterFile()
+        copy = regs.copy()
+        copy[5][14] = 3
+        self.assertEqual(regs[5][14], 0)
+        self.assertEqual(regs.diff(copy), [(5, 14, 0, 3)])
+        copy[5][14] = 0
+        self.assertEqual(hash(regs), hash(copy))
+
+    def test_packed_matches_lists(self):
+        e = emutools.create_emulator(packed=True)
+        execute_seq(e, [K4, KINV, KSQRT], print_disp=False)
+        f = emutools.create_emulator()
+        execute_seq(f, [K4, KINV, KSQRT], print_disp=False)
+        self.assertEqual(emutools.state_diff(e, f), {})
+        self.assertEqual(emutools.state_key(e), emutools.state_key(f))
+        e.keycode = f.keycode = KMODE
+        for i in range(500):
+            e.step()
+            f.step()
+            self.assertEqual(emutools.state_diff(e, f), {})
+
+
+class TestArithHarness(unittest.TestCase):
+    def reference(self, name, a, b):
+        return arith_harness.reference(name, Decimal(a), Decimal(b),
+                                       arith_harness.context())
+
+    def test_reference_rounds_once(self):
+        self.assertEqual(self.reference("subr01", "1E50", "1E-50"),
+                         Decimal("9.9999999999E+49"))
+        self.assertEqual(self.reference("addr01", "9.9999999999", "-1E-40"),
+                         Decimal("9.9999999998"))
+        self.assertEqual(self.reference("neg_abs_add1", "-1E-20", "0"),
+                         Decimal("0.99999999999"))
+        self.assertEqual(self.reference("divr01", "2", "3"),
+                         Decimal("0.66666666666"))
+
+    def test_reference_errors(self):
+        self.assertIsNone(self.reference("divr01", "1", "0"))
+        self.assertIsNone(self.reference("mulr01", "1E60", "1E60"))
+
+    def test_evaluate_in_workers(self):
+        start = emutools.create_emulator()
+        pairs = [(Decimal(a), Decimal("2.1"))
+                 for a in ["1", "2.5", "-3", "123.45", "0.001", "7"]]
+        expected = []
+        for a, b in pairs:
+            e = start.fork()
+            set_num(e, 0, a)
+            set_num(e, 1, b)
+            e.call(0x0c2)
+            expected.append(decode_num(e.regs[0]))
+        for workers in (1, 2):
+            self.assertEqual(arith_harness.evaluate("mulr01", pairs, start,
+                                                    workers, chunk=2),
+                             expected)
+
+    def test_encode_matches_set_num(self):
+        e = emutools.create_emulator()
+        for v in ["0", "1", "-1", "123.45", "-0.00012", "9.9999999999E99",
+                  "1E-99", "-5E-7"]:
+            set_num(e, 0, Decimal(v))
+            self.assertEqual(arith_harness.encode(Decimal(v)),
+                             list(e.regs[0][:14]), v)
+
+
+if __name__ == "__main__":
+    unittest.main()
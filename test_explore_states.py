@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+import os
+import tempfile
+import unittest
+
+from emutools import at_keyscan
+from explore_states import Explorer, canonical, state_hash, to_keyscan
+from keys import *
+
+KEYS = [K1, KPLUS, KC]
+
+class TestExploreStates(unittest.TestCase):
+    def test_canonical_same_on_cycle(self):
+        e = at_keyscan()
+        f = at_keyscan()
+        to_keyscan(f)
+        h, c = canonical(e)
+        self.assertEqual(canonical(f)[0], h)
+        self.assertEqual(state_hash(c), h)
+
+    def run_explorer(self, path, max_states):
+        ex = Explorer(path, KEYS)
+        ex.run(max_states, workers=1)
+        ex.close()
+        return ex
+
+    def read(self, path, name):
+        with open(os.path.join(path, name), "rb") as f:
+            return f.read()
+
+    def test_resume_after_partial_write(self):
+        with tempfile.TemporaryDirectory() as a, \
+             tempfile.TemporaryDirectory() as b:
+            first = self.run_explorer(a, 2)
+            # A search stopped in the middle of writing records.
+            with open(os.path.join(a, "states.bin"), "ab") as f:
+                f.write(b"\1" * 7)
+            with open(os.path.join(a, "edges.bin"), "ab") as f:
+                f.write(b"\2" * 5)
+            ex = Explorer(a, KEYS)
+            self.assertEqual(ex.offsets, first.offsets)
+            self.assertEqual(ex.frontier, first.frontier)
+            self.assertEqual(ex.expanded, 2)
+            ex.close()
+            self.run_explorer(a, 4)
+            self.run_explorer(b, 4)
+            for name in ["states.bin", "edges.bin"]:
+                self.assertEqual(self.read(a, name), self.read(b, name))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+#!/usr/bin/python3
+
+import os
+import tempfile
+import unittest
+
+import rom_format
+
+class TestRomFormat(unittest.TestCase):
+    def test_text_round_trip(self):
+        with open(rom_format.TEXT_PATH) as f:
+            lines = [line.strip() for line in f if line.strip()]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rom.bin")
+            rom_format.convert_text(rom_format.TEXT_PATH, path)
+            rom = rom_format.PackedRom(path)
+            self.assertEqual(rom.lines(), lines)
+            self.assertEqual(rom.sources, [rom_format.TEXT_PATH])
+            self.assertEqual(rom.bit(3, 100), int(lines[3][100]))
+            del rom
+
+
+if __name__ == "__main__":
+    unittest.main()
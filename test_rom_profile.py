@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+import unittest
+
+import emutools
+from annotations import Annotations
+from calculator import *
+from keys import *
+from rom_profile import ROM_SIZE, Profiler
+
+class TestAnnotations(unittest.TestCase):
+    def test_parse(self):
+        ann = Annotations()
+        self.assertEqual(ann.labels[0x04a], "normalize_r0")
+        self.assertEqual(ann.addrs["mulr01"], 0x0c2)
+        self.assertIn("pi/180", ann.comments[0x277])
+        self.assertIn(0x381, ann.marked)
+
+    def test_names(self):
+        ann = Annotations()
+        self.assertEqual(ann.name(None), "(top)")
+        self.assertEqual(ann.name(0x0c2), "mulr01")
+        self.assertEqual(ann.name(0x123), "123")
+        self.assertEqual(ann.describe(0x2dd), "2dd (key: swap)")
+        self.assertEqual(ann.describe(0x0d4), "0d4 pi_to_r0")
+
+
+class TestProfiler(unittest.TestCase):
+    def check_totals(self, prof, steps):
+        self.assertEqual(sum(prof.counts) + prof.skipped, steps)
+        self.assertEqual(sum(prof.exclusive.values()), steps)
+        self.assertEqual(prof.inclusive[None], steps)
+        self.assertTrue(prof.report().startswith(f"{steps} steps"))
+
+    def test_key_totals(self):
+        e = emutools.at_keyscan([K4, KMUL, K5])
+        prof = Profiler().attach(e)
+        start = e.steps
+        execute_seq(e, [KPLUS], print_disp=False)
+        prof.detach(e)
+        self.check_totals(prof, e.steps - start)
+        self.assertEqual(prof.skipped, 0)
+        self.assertTrue(prof.calls)
+
+    def test_skipped_steps(self):
+        e = emutools.at_keyscan()
+        prof = Profiler().attach(e)
+        e.run(max_steps=e.steps + 100000)
+        prof.detach(e)
+        self.check_totals(prof, 100000)
+        self.assertGreater(prof.skipped, 0)
+
+    def test_coverage(self):
+        e = emutools.at_keyscan()
+        prof = Profiler().attach(e)
+        execute_seq(e, [K4], print_disp=False)
+        prof.detach(e)
+        bitmap = prof.coverage()
+        for addr in range(ROM_SIZE):
+            self.assertEqual(bool(bitmap[addr >> 3] >> (addr & 7) & 1),
+                             prof.counts[addr] > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
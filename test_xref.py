@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+
+import unittest
+
+import emutools
+import xref
+from calculator import *
+from keys import *
+
+def traced_transfers(keys, setup=()):
+    # (pc, kind, target) of every step of pressing the keys.
+    e = emutools.at_keyscan(list(setup))
+    edges = {}
+    rec = xref.Recorder(edges).attach(e)
+    execute_seq(e, keys, print_disp=False)
+    rec.detach(e)
+    return {(pc, kind, target) for pc, out in edges.items()
+            for kind, target in out}
+
+class TestXref(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.xref = xref.load_xref()
+        cls.transfers = traced_transfers([K4], xref.SETUPS[1])
+
+    def test_traced_transfers_are_indexed(self):
+        for pc, kind, target in self.transfers:
+            self.assertIn((kind, target), self.xref.edges[pc],
+                          f"{pc:03x} {kind} {target}")
+
+    def test_who_calls_normalize(self):
+        callers = self.xref.who_calls(0x04a)
+        self.assertTrue(callers)
+        for addr in callers:
+            self.assertIn((xref.CALL, 0x04a), self.xref.edges[addr])
+
+    def test_paths_from_keyscan(self):
+        # Every address executed after a key press is reached from the
+        # scan loop by a path of indexed transfers.
+        for pc in {pc for pc, kind, target in self.transfers}:
+            path = self.xref.path(emutools.KEYSCAN, pc)
+            self.assertIsNotNone(path, f"{pc:03x}")
+            self.assertEqual(path[-1], pc)
+            for a, b in zip(path, path[1:]):
+                self.assertTrue(any(
+                    b in self.xref.successors(a, kind, target)
+                    for kind, target in self.xref.edges[a]))
+            if pc != emutools.KEYSCAN:
+                self.assertIn(emutools.KEYSCAN, self.xref.reaching(pc))
+
+    def test_digit_entry_reachable(self):
+        # 0x34d handles the digit keys, 0x36d the pi key.
+        for addr in (0x34d, 0x36d):
+            self.assertIn(emutools.KEYSCAN, self.xref.reaching(addr))
+
+
+if __name__ == "__main__":
+    unittest.main()
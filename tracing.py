@@ -0,0 +1,178 @@
+# Execution traces of the emulator.
+#
+# A Trace is added to Emulator.hooks and records the pc after every step,
+# and optionally the register digits that the step changed, into
+# preallocated arrays. Without a path it keeps the last capacity records.
+# With a path, a full buffer is flushed to a trace file before a record
+# would overwrite one, so the length of a trace is only limited by the
+# disk.
+#
+# A trace file is a sequence of zlib-compressed chunks followed by an index
+# of the chunks, so a reader can seek to any range of steps:
+#   chunk header  CHUNK: kind, count, first step, last step, size
+#   chunk data    zlib of the step numbers (uint64) and the values
+#   index         INDEX for each chunk: kind, first step, last step, offset
+#   footer        FOOTER: index offset, number of chunks, MAGIC
+# Values are uint16: pcs for PC chunks, reg << 8 | digit << 4 | value for
+# REGS chunks. All numbers are little endian.
+
+import struct
+import zlib
+from array import array
+from functools import partial
+
+MAGIC = b"MK51TRC1"
+PC = 0
+REGS = 1
+CHUNK = struct.Struct("<BIQQI")
+INDEX = struct.Struct("<BQQQ")
+FOOTER = struct.Struct("<QQ8s")
+
+class Buffer:
+    def __init__(self, capacity, flush=None):
+        self.capacity = capacity
+        self.steps = array("Q", bytes(8 * capacity))
+        self.values = array("H", bytes(2 * capacity))
+        # Number of records written since the last flush.
+        self.n = 0
+        # Called with the buffer when it is full and another record is
+        # added, instead of overwriting the oldest record. Must reset n.
+        self.flush = flush
+
+    def add(self, step, value):
+        if self.flush is not None and self.n >= self.capacity:
+            self.flush(self)
+        i = self.n % self.capacity
+        self.steps[i] = step
+        self.values[i] = value
+        self.n += 1
+
+    def records(self):
+        # Records in the buffer, oldest first.
+        if self.n <= self.capacity:
+            return self.steps[:self.n], self.values[:self.n]
+        i = self.n % self.capacity
+        return (self.steps[i:] + self.steps[:i],
+                self.values[i:] + self.values[:i])
+
+class Trace:
+    def __init__(self, capacity=1 << 20, ranges=None, regs=False,
+                 pcs=True, path=None):
+        # ranges: list of (start, limit) addresses; only steps ending at
+        # a pc in one of them are recorded.
+        self.ranges = ranges
+        self.file = None
+        self.index = []
+        if path is not None:
+            self.file = open(path, "wb")
+        self.bufs = {}
+        for kind, on in ((PC, pcs), (REGS, regs)):
+            if on:
+                self.bufs[kind] = Buffer(
+                    capacity,
+                    None if path is None else partial(self.flush_buffer, kind))
+        self.prev_regs = None
+        self.prev_step = None
+
+    def __call__(self, e):
+        pc = e.pc
+        if self.ranges is not None and not any(
+                lo <= pc < hi for lo, hi in self.ranges):
+            self.prev_regs = None
+            return
+        step = e.steps
+        if PC in self.bufs:
+            self.bufs[PC].add(step, pc)
+        if REGS in self.bufs:
+            regs = [list(r) for r in e.regs]
+            # Changes are only known for consecutive recorded steps.
+            if self.prev_regs is not None and self.prev_step == step - 1:
+                for r, (old, new) in enumerate(zip(self.prev_regs, regs)):
+                    if old != new:
+                        for d, v in enumerate(new):
+                            if v != old[d]:
+                                self.bufs[REGS].add(step,
+                                                    r << 8 | d << 4 | v)
+            self.prev_regs = regs
+        self.prev_step = step
+
+    def attach(self, e):
+        e.hooks.append(self)
+        return self
+
+    def detach(self, e):
+        e.hooks.remove(self)
+
+    def pcs(self):
+        # Steps and pcs still in memory.
+        return self.bufs[PC].records()
+
+    def reg_changes(self):
+        return self.bufs[REGS].records()
+
+    def flush_buffer(self, kind, buf):
+        steps, values = buf.records()
+        if not steps:
+            return
+        data = zlib.compress(steps.tobytes() + values.tobytes())
+        self.index.append((kind, steps[0], steps[-1], self.file.tell()))
+        self.file.write(CHUNK.pack(kind, len(steps), steps[0], steps[-1],
+                                   len(data)))
+        self.file.write(data)
+        buf.n = 0
+
+    def flush(self):
+        for kind, buf in self.bufs.items():
+            self.flush_buffer(kind, buf)
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        start = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX.pack(*entry))
+        self.file.write(FOOTER.pack(start, len(self.index), MAGIC))
+        self.file.close()
+        self.file = None
+
+class TraceFile:
+    def __init__(self, path):
+        self.f = open(path, "rb")
+        self.f.seek(-FOOTER.size, 2)
+        start, n, magic = FOOTER.unpack(self.f.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        self.f.seek(start)
+        self.index = [INDEX.unpack(self.f.read(INDEX.size))
+                      for i in range(n)]
+
+    def close(self):
+        self.f.close()
+
+    def read(self, kind, first=0, last=None):
+        # Records of the given kind with steps in [first, last].
+        steps = array("Q")
+        values = array("H")
+        for k, lo, hi, offset in self.index:
+            if k != kind or hi < first or (last is not None and lo > last):
+                continue
+            self.f.seek(offset)
+            _, count, _, _, size = CHUNK.unpack(self.f.read(CHUNK.size))
+            data = zlib.decompress(self.f.read(size))
+            s = array("Q", data[:8 * count])
+            v = array("H", data[8 * count:])
+            for step, value in zip(s, v):
+                if step >= first and (last is None or step <= last):
+                    steps.append(step)
+                    values.append(value)
+        return steps, values
+
+    def pcs(self, first=0, last=None):
+        return self.read(PC, first, last)
+
+    def reg_changes(self, first=0, last=None):
+        # (steps, reg, digit, value) of the register changes.
+        steps, values = self.read(REGS, first, last)
+        return (steps, [v >> 8 for v in values], [v >> 4 & 15 for v in values],
+                [v & 15 for v in values])
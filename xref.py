@@ -0,0 +1,224 @@
+# Cross-reference index of the whole ROM.
+#
+# The control flow is recorded from real runs: powering on and pressing
+# every key after every prefix, with and without a number entered. After
+# each step, the pc together with the change of the depth of the return
+# stack tells whether the previous address continued to the next one,
+# jumped, called or returned. Every transfer in the index was taken from
+# a reachable state, but the ones that no run takes are missing, so the
+# index is a lower bound of the control flow, and so are reaching() and
+# path(). The result is cached on disk, keyed by the ROM file contents, so
+# queries don't need the emulator.
+
+import os
+import pickle
+from collections import deque
+
+from annotations import Annotations
+# emutools adds the mk51fx2500re submodule to sys.path.
+from emutools import KEYSCAN, at_keyscan, create_emulator, rom_hash
+from calculator import execute_seq
+from keys import *
+from rom_profile import ROM_SIZE
+
+CACHE_DIR = ".cache"
+# Changes whenever the recording changes, to invalidate old caches.
+VERSION = 3
+
+# Keys pressed, after each of the prefixes, after each of the setups.
+SETUPS = [[], [K4, K5]]
+PREFIXES = [[], [KINV], [KF1], [KF2], [KINV, KMODE], [KINV, KMODE, KINV],
+            [KINV, KMODE, KF2]]
+KEYS = [row * 10 + col for row in range(8) for col in range(1, 6)]
+
+NEXT = "next"
+JUMP = "jump"
+CALL = "call"
+RETURN = "return"
+
+def transfer(pc, depth, e):
+    # Kind and target of the step from pc, with depth entries on the
+    # return stack, to the state of e.
+    if len(e.stack) > depth:
+        return CALL, e.pc
+    if len(e.stack) < depth:
+        return RETURN, None
+    if e.pc == pc + 1:
+        return NEXT, e.pc
+    return JUMP, e.pc
+
+class Recorder:
+    # Hook adding the transfer of every step to edges, addr -> set of
+    # (kind, target).
+    def __init__(self, edges):
+        self.edges = edges
+        self.last = None
+
+    def attach(self, e):
+        self.last = (e.pc, len(e.stack))
+        e.hooks.append(self)
+        return self
+
+    def detach(self, e):
+        e.hooks.remove(self)
+
+    def __call__(self, e):
+        pc, depth = self.last
+        self.edges.setdefault(pc, set()).add(transfer(pc, depth, e))
+        self.last = (e.pc, len(e.stack))
+
+def record_edges():
+    edges = {}
+    e = create_emulator()
+    rec = Recorder(edges).attach(e)
+    e.until(KEYSCAN)
+    rec.detach(e)
+    for setup in SETUPS:
+        for prefix in PREFIXES:
+            for key in KEYS:
+                e = at_keyscan(setup + prefix)
+                rec = Recorder(edges).attach(e)
+                execute_seq(e, [key], print_disp=False)
+                rec.detach(e)
+    return edges
+
+class Xref:
+    def __init__(self, edges, annotations=None):
+        # edges: addr -> set of (kind, target).
+        self.edges = edges
+        self.annotations = annotations or Annotations()
+        self.callers = {}
+        self.jumpers = {}
+        self.preds = {}
+        for addr, out in edges.items():
+            for kind, target in out:
+                if kind == CALL:
+                    self.callers.setdefault(target, set()).add(addr)
+                elif kind == JUMP:
+                    self.jumpers.setdefault(target, set()).add(addr)
+                for succ in self.successors(addr, kind, target):
+                    self.preds.setdefault(succ, set()).add(addr)
+        self.entries = sorted(self.callers)
+        self.leaders = self.find_leaders()
+
+    def successors(self, addr, kind, target):
+        if kind == CALL:
+            # After the call returns execution continues at addr + 1.
+            return [target, addr + 1]
+        if kind == RETURN:
+            return []
+        return [target]
+
+    def find_leaders(self):
+        leaders = {0}
+        for addr, out in self.edges.items():
+            for kind, target in out:
+                if kind in (JUMP, CALL):
+                    leaders.add(target)
+                if kind != NEXT:
+                    leaders.add(addr + 1)
+        return sorted(a for a in leaders if a < ROM_SIZE)
+
+    def blocks(self):
+        # Basic blocks as (start, limit) address ranges.
+        limits = self.leaders[1:] + [ROM_SIZE]
+        return list(zip(self.leaders, limits))
+
+    def routine(self, entry):
+        # Addresses reachable from entry without following calls.
+        seen = set()
+        todo = [entry]
+        while todo:
+            addr = todo.pop()
+            if addr in seen or addr not in self.edges:
+                continue
+            seen.add(addr)
+            for kind, target in self.edges[addr]:
+                if kind == CALL:
+                    todo.append(addr + 1)
+                elif kind != RETURN:
+                    todo.append(target)
+        return seen
+
+    def call_graph(self):
+        # Routine entry -> entries of the routines it calls.
+        graph = {}
+        for entry in self.entries:
+            calls = set()
+            for addr in self.routine(entry):
+                calls.update(t for k, t in self.edges[addr] if k == CALL)
+            graph[entry] = calls
+        return graph
+
+    def who_calls(self, addr):
+        return sorted(self.callers.get(addr, ()))
+
+    def who_jumps_to(self, addr):
+        return sorted(self.jumpers.get(addr, ()))
+
+    def reaching(self, addr):
+        # All addresses from which execution can get to addr.
+        seen = set()
+        todo = deque([addr])
+        while todo:
+            a = todo.popleft()
+            for p in self.preds.get(a, ()):
+                if p not in seen:
+                    seen.add(p)
+                    todo.append(p)
+        return seen
+
+    def path(self, src, dst):
+        # A shortest path of addresses from src to dst, or None.
+        prev = {src: None}
+        todo = deque([src])
+        while todo:
+            a = todo.popleft()
+            if a == dst:
+                res = []
+                while a is not None:
+                    res.append(a)
+                    a = prev[a]
+                return res[::-1]
+            for kind, target in self.edges.get(a, ()):
+                for succ in self.successors(a, kind, target):
+                    if succ not in prev:
+                        prev[succ] = a
+                        todo.append(succ)
+        return None
+
+    def listing(self):
+        lines = []
+        for addr in range(ROM_SIZE):
+            if addr in self.annotations.labels:
+                lines.append(f"{self.annotations.labels[addr]}:")
+            out = sorted((k, t if t is not None else -1)
+                         for k, t in self.edges.get(addr, ()))
+            flow = ", ".join(k if k in (NEXT, RETURN) else f"{k} "
+                             f"{self.annotations.name(t)}" for k, t in out)
+            refs = ""
+            if addr in self.callers:
+                refs = " <- " + " ".join(f"{a:03x}"
+                                         for a in self.who_calls(addr))
+            comment = "; ".join(self.annotations.comments.get(addr, ()))
+            if comment:
+                comment = f"  # {comment}"
+            lines.append(f"  {addr:03x}  {flow}{refs}{comment}")
+        return "\n".join(lines)
+
+def load_xref(cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, f"xref-{VERSION}-{rom_hash()[:16]}.pickle")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            edges = pickle.load(f)
+    else:
+        edges = record_edges()
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(edges, f)
+        os.replace(tmp, path)
+    return Xref(edges)
+
+if __name__ == "__main__":
+    print(load_xref().listing())